@@ -0,0 +1,118 @@
+import asyncio
+import threading
+from pathlib import Path
+from typing import Callable, Optional
+
+from executor import WorkerPool, use_text_plans, write_result
+from psycopg import AsyncConnection
+from util import conninfo
+
+
+class AsyncWorkerPool(WorkerPool):
+    # Queries are issued from the same worker threads as WorkerPool, but all I/O
+    # goes through psycopg AsyncConnections on a dedicated event loop. Setup SQL is
+    # pipelined and result files are written while the next query executes.
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loop_thread: Optional[threading.Thread] = None
+        # Worker threads queue writes concurrently, so pending_writes is only
+        # read or rebound while holding pending_lock.
+        self.pending_lock = threading.Lock()
+        self.pending_writes = []
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def setup(self):
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.loop_thread.start()
+        self.conns = self.submit(self._setup()).result()
+
+    async def _setup(self):
+        aconns = await asyncio.gather(
+            *[
+                AsyncConnection.connect(conninfo(), autocommit=True)
+                for _ in range(self.num_workers)
+            ]
+        )
+        if self.plan_fetch == "text":
+            for aconn in aconns:
+                use_text_plans(aconn)
+        setup_sql = self.before_sql + [f"SET statement_timeout = '{self.timeout_s}s'"]
+        # Connections are set up one at a time since before_sql may reset shared
+        # state, but each connection's setup is a single pipelined round trip.
+        for aconn in aconns:
+            await self._pipeline(aconn, setup_sql)
+        return aconns
+
+    async def _pipeline(self, aconn: AsyncConnection, sqls: list[str]):
+        async with aconn.pipeline():
+            for sql in sqls:
+                if self.verbose:
+                    print(sql)
+                await aconn.execute(sql)
+
+    async def _execute(self, aconn: AsyncConnection, sql: str, fetch: bool):
+        cur = await aconn.execute(sql)
+        if fetch:
+            return (await cur.fetchone())[0]
+        return None
+
+    def run_sql(self, sql: str, fetch=False):
+        return self.submit(self._execute(self.connection(), sql, fetch)).result()
+
+    def write(
+        self,
+        outpath_res: Path,
+        contents: Optional[str],
+        *touch_paths: Path,
+        done: Optional[Callable[[], None]] = None,
+    ):
+        if self.loop is None:
+            super().write(outpath_res, contents, *touch_paths, done=done)
+            return
+        future = self.submit(
+            asyncio.to_thread(
+                write_result, outpath_res, contents, list(touch_paths), done
+            )
+        )
+        with self.pending_lock:
+            self.pending_writes = [f for f in self.pending_writes if not f.done()]
+            self.pending_writes.append(future)
+
+    def finish(self, after_sql: list[str], teardown_sql: Optional[list[str]] = None):
+        self.drain()
+        if self.readied:
+            self.submit(self._finish(after_sql, teardown_sql or [])).result()
+
+    async def _finish(self, after_sql: list[str], teardown_sql: list[str]):
+        await self._pipeline(self.conns[0], after_sql)
+        for aconn in self.conns:
+            await self._pipeline(aconn, teardown_sql)
+
+    def drain(self):
+        with self.pending_lock:
+            for future in self.pending_writes:
+                future.result()
+            self.pending_writes = []
+
+    async def _close(self):
+        for aconn in self.conns:
+            await aconn.close()
+
+    def close(self):
+        if self.loop is None:
+            return
+        try:
+            self.drain()
+            if self.readied:
+                self.submit(self._close()).result()
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.loop_thread.join()
+            self.loop.close()
+            self.loop = None
+            self.conns = [self.conn]
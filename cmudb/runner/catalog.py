@@ -0,0 +1,137 @@
+import hashlib
+from pathlib import Path
+from typing import Optional
+
+import psycopg
+
+# Load state lives in the loaded database itself, so it cannot drift from the
+# data it describes. A row is only written, in the same transaction as the work,
+# once that work is complete; a missing row means "not done".
+# Kinds: "schema" and "post_load" steps are keyed by file name, "table" rows by
+# table name.
+# The catalog has its own schema, so that every relation listing (prewarm,
+# vacuum, footprints, sample sizes), which only looks at current_schema(), sees
+# the benchmark tables alone.
+CATALOG_SCHEMA = "boot_catalog"
+CATALOG_TABLE = f"{CATALOG_SCHEMA}.load_catalog"
+CHECKSUM_BLOCK_SIZE = 1 << 20
+
+
+def new_hasher():
+    return hashlib.blake2b(digest_size=16)
+
+
+def file_checksum(path: Path) -> str:
+    hasher = new_hasher()
+    with open(path, "rb") as f:
+        while data := f.read(CHECKSUM_BLOCK_SIZE):
+            hasher.update(data)
+    return hasher.hexdigest()
+
+
+def ensure_catalog(conn: psycopg.Connection):
+    conn.execute(f"CREATE SCHEMA IF NOT EXISTS {CATALOG_SCHEMA}")
+    # Catalogs created before the catalog schema are moved, not rebuilt.
+    legacy, current = conn.execute(
+        "SELECT to_regclass('load_catalog'), to_regclass(%s)", (CATALOG_TABLE,)
+    ).fetchone()
+    if legacy is not None and current is None:
+        conn.execute(f"ALTER TABLE load_catalog SET SCHEMA {CATALOG_SCHEMA}")
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {CATALOG_TABLE} ("
+        "kind text NOT NULL, "
+        "name text NOT NULL, "
+        "source text NOT NULL, "
+        "source_bytes bigint NOT NULL, "
+        "source_mtime_ns bigint NOT NULL, "
+        "checksum text NOT NULL, "
+        "num_rows bigint, "
+        "loaded_at timestamptz NOT NULL DEFAULT now(), "
+        "vacuumed_at timestamptz, "
+        "PRIMARY KEY (kind, name))"
+    )
+
+
+def catalog_entries(conn: psycopg.Connection, kind: str) -> dict[str, dict]:
+    cur = conn.execute(
+        f"SELECT name, source, source_bytes, source_mtime_ns, checksum, num_rows "
+        f"FROM {CATALOG_TABLE} WHERE kind = %s",
+        (kind,),
+    )
+    columns = [column.name for column in cur.description]
+    return {row[0]: dict(zip(columns, row)) for row in cur.fetchall()}
+
+
+def record(
+    conn: psycopg.Connection,
+    kind: str,
+    name: str,
+    source: Path,
+    source_stat,
+    checksum: str,
+    num_rows: Optional[int] = None,
+):
+    conn.execute(
+        f"INSERT INTO {CATALOG_TABLE} "
+        "(kind, name, source, source_bytes, source_mtime_ns, checksum, num_rows) "
+        "VALUES (%s, %s, %s, %s, %s, %s, %s) "
+        "ON CONFLICT (kind, name) DO UPDATE SET "
+        "source = EXCLUDED.source, source_bytes = EXCLUDED.source_bytes, "
+        "source_mtime_ns = EXCLUDED.source_mtime_ns, "
+        "checksum = EXCLUDED.checksum, num_rows = EXCLUDED.num_rows, "
+        "loaded_at = now(), vacuumed_at = NULL",
+        (
+            kind,
+            name,
+            str(source.absolute()),
+            source_stat.st_size,
+            source_stat.st_mtime_ns,
+            checksum,
+            num_rows,
+        ),
+    )
+
+
+def forget(conn: psycopg.Connection, kind: str, names: Optional[list[str]] = None):
+    if names is None:
+        conn.execute(f"DELETE FROM {CATALOG_TABLE} WHERE kind = %s", (kind,))
+    else:
+        conn.execute(
+            f"DELETE FROM {CATALOG_TABLE} WHERE kind = %s AND name = ANY(%s)",
+            (kind, names),
+        )
+
+
+def unvacuumed(conn: psycopg.Connection) -> list[str]:
+    cur = conn.execute(
+        f"SELECT name FROM {CATALOG_TABLE} "
+        "WHERE kind = 'table' AND vacuumed_at IS NULL ORDER BY name"
+    )
+    return [name for name, in cur.fetchall()]
+
+
+def mark_vacuumed(conn: psycopg.Connection, tables: list[str]):
+    conn.execute(
+        f"UPDATE {CATALOG_TABLE} SET vacuumed_at = now() "
+        "WHERE kind = 'table' AND name = ANY(%s)",
+        (tables,),
+    )
+
+
+def is_current(entry: Optional[dict], source: Path) -> bool:
+    # Same path, size and mtime is trusted as-is. Otherwise, e.g., when the data
+    # was regenerated, the file is only reloaded if its contents differ. A loaded
+    # source that has since been deleted is current, there is nothing to reload.
+    if entry is None:
+        return False
+    if not source.exists():
+        return True
+    stat = source.stat()
+    if entry["source_bytes"] != stat.st_size:
+        return False
+    if (
+        entry["source"] == str(source.absolute())
+        and entry["source_mtime_ns"] == stat.st_mtime_ns
+    ):
+        return True
+    return entry["checksum"] == file_checksum(source)
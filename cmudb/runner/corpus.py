@@ -0,0 +1,122 @@
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+import threading
+from pathlib import Path
+from typing import Optional
+
+from util import sql_file_queries
+
+# Layout: MAGIC | u64 index length | pickled index | statement blob.
+# The index maps an absolute query path to (content digest, [(offset, length)]),
+# with offsets into the blob of the UTF-8 encoded, pre-split statements.
+MAGIC = b"QCORPUS\x01"
+HEADER = struct.Struct("<8sQ")
+
+
+def digest(contents: bytes) -> bytes:
+    return hashlib.blake2b(contents, digest_size=16).digest()
+
+
+class QueryCorpus:
+    def __init__(self, corpus_path: Path):
+        self.corpus_path = corpus_path
+        self.lock = threading.Lock()
+        self.mm: Optional[mmap.mmap] = None
+        self.blob_start = 0
+        self.index = {}
+        # Entries parsed in this process but not yet saved.
+        self.added = {}
+        # Queries already verified in this process, by path.
+        self.memo = {}
+        self.load()
+
+    def load(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        self.index = {}
+        if not self.corpus_path.exists():
+            return
+        with open(self.corpus_path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, index_len = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC:
+            mm.close()
+            return
+        self.mm = mm
+        self.blob_start = HEADER.size + index_len
+        self.index = pickle.loads(mm[HEADER.size : self.blob_start])
+
+    def statements(self, spans) -> list[str]:
+        return [
+            self.mm[
+                self.blob_start + offset : self.blob_start + offset + length
+            ].decode()
+            for offset, length in spans
+        ]
+
+    def queries(self, filepath: Path) -> list[str]:
+        key = str(filepath.absolute())
+        with self.lock:
+            if key in self.memo:
+                return self.memo[key]
+
+        with open(filepath, "rb") as f:
+            file_digest = digest(f.read())
+
+        with self.lock:
+            if key in self.added and self.added[key][0] == file_digest:
+                queries = self.added[key][1]
+            elif key in self.index and self.index[key][0] == file_digest:
+                queries = self.statements(self.index[key][1])
+            else:
+                queries = sql_file_queries(filepath)
+                self.added[key] = (file_digest, queries)
+            self.memo[key] = queries
+            return queries
+
+    def save(self):
+        with self.lock:
+            if len(self.added) == 0:
+                return
+
+            entries = {}
+            for key, (file_digest, spans) in self.index.items():
+                entries[key] = (file_digest, self.statements(spans))
+            entries.update(self.added)
+
+            blob = bytearray()
+            index = {}
+            for key, (file_digest, queries) in entries.items():
+                spans = []
+                for query in queries:
+                    encoded = query.encode()
+                    spans.append((len(blob), len(encoded)))
+                    blob += encoded
+                index[key] = (file_digest, spans)
+            index_bytes = pickle.dumps(index, protocol=pickle.HIGHEST_PROTOCOL)
+
+            self.corpus_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.corpus_path.with_suffix(f".tmp{os.getpid()}")
+            with open(tmp_path, "wb") as f:
+                f.write(HEADER.pack(MAGIC, len(index_bytes)))
+                f.write(index_bytes)
+                f.write(blob)
+            os.replace(tmp_path, self.corpus_path)
+
+            self.added = {}
+            self.load()
+
+
+_corpus: Optional[QueryCorpus] = None
+
+
+def corpus() -> QueryCorpus:
+    global _corpus
+    if _corpus is None:
+        artifact_root = Path(os.getenv("ARTIFACT_ROOT"))
+        _corpus = QueryCorpus(artifact_root / "cache" / "corpus.bin")
+    return _corpus
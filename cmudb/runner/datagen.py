@@ -0,0 +1,277 @@
+import errno
+import os
+import re
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import psycopg
+from catalog import file_checksum, record
+from loader import COPY_BLOCK_SIZE, copy_stream, report_copy
+from util import conninfo
+
+# Each generator invocation writes its output files into FIFOs, and every FIFO
+# is streamed straight into COPY FROM STDIN by its own thread, so no table data
+# is ever written to disk. Invocations are chunked (dbgen -C/-S, dsdgen
+# -parallel/-child) and run LOAD_WORKERS at a time.
+
+
+def stream_fifo(fifo_path: Path, table: Optional[str]) -> tuple[int, int]:
+    # Opening the FIFO blocks until the generator opens it for writing.
+    with open(fifo_path, "rb") as f:
+        if table is None:
+            # Generated alongside a table that is being loaded, not needed.
+            while f.read(COPY_BLOCK_SIZE):
+                pass
+            return 0, 0
+        with psycopg.connect(conninfo(), autocommit=True) as conn:
+            conn.execute("SET statement_timeout = '0s'")
+            with conn.cursor() as cur:
+                num_bytes = copy_stream(cur, table, f)
+                return num_bytes, cur.rowcount
+
+
+class FifoReader(threading.Thread):
+    def __init__(self, fifo_path: Path, table: Optional[str]):
+        super().__init__(daemon=True)
+        self.fifo_path = fifo_path
+        self.table = table
+        self.result = (0, 0)
+        self.error: Optional[BaseException] = None
+
+    def run(self):
+        try:
+            self.result = stream_fifo(self.fifo_path, self.table)
+        except BaseException as e:
+            self.error = e
+
+
+def release_fifo(fifo_path: Path, reader: FifoReader):
+    # Unblocks a reader whose FIFO the generator never opened. Opening the write
+    # end fails with ENXIO until the reader is waiting on the read end.
+    while reader.is_alive():
+        try:
+            fd = os.open(fifo_path, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError as e:
+            if e.errno != errno.ENXIO:
+                raise
+            time.sleep(0.01)
+            continue
+        os.close(fd)
+        break
+    reader.join()
+
+
+class DataGenerator:
+    def __init__(self, binary: Path, sf: int, num_chunks: int):
+        self.binary = binary
+        self.sf = sf
+        self.num_chunks = max(1, num_chunks)
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def groups(self) -> list[list[str]]:
+        # Tables that a single invocation generates together.
+        raise NotImplementedError
+
+    def chunks(self, group: list[str]) -> list[int]:
+        raise NotImplementedError
+
+    def command(self, group: list[str], chunk: int, out_dir: Path) -> list[str]:
+        raise NotImplementedError
+
+    def env(self, out_dir: Path) -> dict:
+        return dict(os.environ)
+
+    def output_name(self, table: str, chunk: int) -> str:
+        raise NotImplementedError
+
+    def output_table(self, filename: str) -> str:
+        raise NotImplementedError
+
+    def add(self, table: str, num_bytes: int, num_rows: int):
+        with self.lock:
+            self.stats[table]["Bytes"] += num_bytes
+            self.stats[table]["Rows"] += num_rows
+
+    def generate(self, group: list[str], chunk: int, tables: list[str]):
+        with tempfile.TemporaryDirectory(prefix="datagen-") as tmp_dir:
+            out_dir = Path(tmp_dir)
+            readers = []
+            for table in group:
+                fifo_path = out_dir / self.output_name(table, chunk)
+                os.mkfifo(fifo_path)
+                reader = FifoReader(fifo_path, table if table in tables else None)
+                reader.start()
+                readers.append(reader)
+
+            proc = subprocess.run(
+                self.command(group, chunk, out_dir),
+                cwd=self.binary.parent,
+                env=self.env(out_dir),
+                stdout=subprocess.DEVNULL,
+            )
+            for reader in readers:
+                release_fifo(reader.fifo_path, reader)
+            for reader in readers:
+                if reader.error is not None:
+                    raise reader.error
+                if reader.table is not None:
+                    self.add(reader.table, *reader.result)
+            if proc.returncode != 0:
+                raise RuntimeError(
+                    f"{self.binary.name} failed ({proc.returncode}): {group} {chunk}"
+                )
+
+            # Anything written under an unexpected name is still loaded.
+            for path in out_dir.iterdir():
+                if not path.is_file():
+                    continue
+                table = self.output_table(path.name)
+                if table in tables:
+                    self.add(table, *stream_fifo(path, table))
+
+    def load_tables(self, tables: list[str], verbose=True) -> list[dict]:
+        num_workers = max(1, int(os.getenv("LOAD_WORKERS", "4")))
+        start = time.time()
+        self.stats = {
+            table: {"Table": table, "Rows": 0, "Bytes": 0} for table in tables
+        }
+        jobs = [
+            (group, chunk)
+            for group in self.groups()
+            if len(set(group) & set(tables)) > 0
+            for chunk in self.chunks(group)
+        ]
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            futures = []
+            for group, chunk in jobs:
+                if verbose:
+                    print(" ".join(self.command(group, chunk, Path("<fifo>"))))
+                futures.append(executor.submit(self.generate, group, chunk, tables))
+            for future in futures:
+                future.result()
+
+        # A table is only complete once every chunk of it is in.
+        elapsed_s = time.time() - start
+        source_stat = self.binary.stat()
+        checksum = file_checksum(self.binary)
+        with psycopg.connect(conninfo(), autocommit=True) as conn:
+            for table in tables:
+                record(
+                    conn,
+                    "table",
+                    table,
+                    self.binary,
+                    source_stat,
+                    checksum,
+                    self.stats[table]["Rows"],
+                )
+        table_stats = []
+        for table in tables:
+            stat = self.stats[table]
+            stat["Seconds"] = elapsed_s
+            stat["MB/s"] = stat["Bytes"] / (1 << 20) / max(elapsed_s, 1e-9)
+            table_stats.append(stat)
+        report_copy(table_stats)
+        return table_stats
+
+
+class TpchGenerator(DataGenerator):
+    TABLE_FLAGS = {
+        "region": "r",
+        "nation": "n",
+        "part": "P",
+        "supplier": "s",
+        "partsupp": "S",
+        "customer": "c",
+        "orders": "O",
+        "lineitem": "L",
+    }
+    # dbgen does not split these.
+    UNCHUNKED = {"region", "nation"}
+
+    def __init__(self, repo_root: Path, sf: int, num_chunks: int):
+        super().__init__(repo_root / "dbgen" / "dbgen", sf, num_chunks)
+
+    def groups(self) -> list[list[str]]:
+        return [[table] for table in self.TABLE_FLAGS]
+
+    def chunked(self, table: str) -> bool:
+        return self.num_chunks > 1 and table not in self.UNCHUNKED
+
+    def chunks(self, group: list[str]) -> list[int]:
+        if self.chunked(group[0]):
+            return list(range(1, self.num_chunks + 1))
+        return [1]
+
+    def command(self, group: list[str], chunk: int, out_dir: Path) -> list[str]:
+        (table,) = group
+        args = [str(self.binary), "-f", "-s", str(self.sf), "-T"]
+        args.append(self.TABLE_FLAGS[table])
+        if self.chunked(table):
+            args.extend(["-C", str(self.num_chunks), "-S", str(chunk)])
+        return args
+
+    def env(self, out_dir: Path) -> dict:
+        # dbgen writes into DSS_PATH and opens FIFOs there without truncating.
+        return {**os.environ, "DSS_PATH": str(out_dir)}
+
+    def output_name(self, table: str, chunk: int) -> str:
+        if self.chunked(table):
+            return f"{table}.tbl.{chunk}"
+        return f"{table}.tbl"
+
+    def output_table(self, filename: str) -> str:
+        return filename.split(".")[0]
+
+
+class DsbGenerator(DataGenerator):
+    # dsdgen generates each returns table along with its sales table.
+    GROUPS = [
+        ["store_sales", "store_returns"],
+        ["catalog_sales", "catalog_returns"],
+        ["web_sales", "web_returns"],
+        ["inventory"],
+    ]
+    # Everything else is small enough that splitting it buys nothing.
+    CHUNKED = {table for group in GROUPS for table in group}
+
+    def __init__(self, repo_root: Path, sf: int, num_chunks: int, tables: list[str]):
+        super().__init__(repo_root / "code" / "tools" / "dsdgen", sf, num_chunks)
+        grouped = {table for group in self.GROUPS for table in group}
+        self.all_groups = self.GROUPS + [
+            [table] for table in tables if table not in grouped
+        ]
+
+    def groups(self) -> list[list[str]]:
+        return self.all_groups
+
+    def chunked(self, table: str) -> bool:
+        return self.num_chunks > 1 and table in self.CHUNKED
+
+    def chunks(self, group: list[str]) -> list[int]:
+        if self.chunked(group[0]):
+            return list(range(1, self.num_chunks + 1))
+        return [1]
+
+    def command(self, group: list[str], chunk: int, out_dir: Path) -> list[str]:
+        table = group[0]
+        args = [str(self.binary), "-scale", str(self.sf), "-table", table]
+        args.extend(["-dir", str(out_dir), "-terminate", "n", "-force", "y"])
+        if self.chunked(table):
+            args.extend(["-parallel", str(self.num_chunks), "-child", str(chunk)])
+        return args
+
+    def output_name(self, table: str, chunk: int) -> str:
+        if self.chunked(table):
+            # Child tables are named after the parent's chunk.
+            return f"{table}_{chunk}_{self.num_chunks}.dat"
+        return f"{table}.dat"
+
+    def output_table(self, filename: str) -> str:
+        return re.sub(r"(_\d+_\d+)?\.dat$", "", filename)
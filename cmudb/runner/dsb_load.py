@@ -1,69 +1,85 @@
 import os
+import sys
 from pathlib import Path
 
-from sqlalchemy import Connection, Engine, create_engine
-from util import (conn_execute, connstr, sql_file_execute,
-                  vacuum_full_analyze_all)
+from datagen import DsbGenerator
+from loader import load_complete, resume_load, vacuum_loaded
+from sqlalchemy import Engine, create_engine
+from util import connstr
 
+TABLES = [
+    "dbgen_version",
+    "customer_address",
+    "customer_demographics",
+    "date_dim",
+    "warehouse",
+    "ship_mode",
+    "time_dim",
+    "reason",
+    "income_band",
+    "item",
+    "store",
+    "call_center",
+    "customer",
+    "web_site",
+    "store_returns",
+    "household_demographics",
+    "web_page",
+    "promotion",
+    "catalog_page",
+    "inventory",
+    "catalog_returns",
+    "web_returns",
+    "web_sales",
+    "catalog_sales",
+    "store_sales",
+]
 
-def loaded(conn: Connection):
-    res = conn_execute(
-        conn,
-        "SELECT * FROM pg_indexes WHERE indexname = '_dta_index_customer_5_949578421__k13_k5'",
-    ).fetchall()
-    return len(res) > 0
 
-
-def load(conn: Connection):
+def schema_paths() -> tuple[Path, Path]:
     schema_root = Path(os.getenv("DSB_SCHEMA_ROOT"))
+    return schema_root / "create_tables.sql", schema_root / "dsb_index_pg.sql"
+
+
+def load(bulk=False, generate=False) -> list[str]:
     data_root = Path(os.getenv("DSB_DATA_ROOT"))
     dsb_sf = int(os.getenv("DSB_SF"))
 
-    tables = [
-        "dbgen_version",
-        "customer_address",
-        "customer_demographics",
-        "date_dim",
-        "warehouse",
-        "ship_mode",
-        "time_dim",
-        "reason",
-        "income_band",
-        "item",
-        "store",
-        "call_center",
-        "customer",
-        "web_site",
-        "store_returns",
-        "household_demographics",
-        "web_page",
-        "promotion",
-        "catalog_page",
-        "inventory",
-        "catalog_returns",
-        "web_returns",
-        "web_sales",
-        "catalog_sales",
-        "store_sales",
-    ]
-
-    sql_file_execute(conn, schema_root / "create_tables.sql")
-    for table in tables:
-        conn_execute(conn, f"TRUNCATE {table} CASCADE")
-    for table in tables:
-        table_path = data_root / f"sf_{dsb_sf}" / f"{table}.dat"
-        conn_execute(conn, f"COPY {table} FROM '{str(table_path)}' CSV DELIMITER '|'")
-    sql_file_execute(conn, schema_root / "dsb_index_pg.sql")
+    generator = None
+    if generate:
+        # Stream the generator's output straight into COPY, no data files.
+        num_chunks = int(os.getenv("LOAD_CHUNKS", os.getenv("LOAD_WORKERS", "4")))
+        repo_root = Path(os.getenv("DSB_REPO_ROOT"))
+        generator = DsbGenerator(repo_root, dsb_sf, num_chunks, TABLES)
+        table_paths = [(table, generator.binary) for table in TABLES]
+    else:
+        table_paths = [
+            (table, data_root / f"sf_{dsb_sf}" / f"{table}.dat") for table in TABLES
+        ]
+    return resume_load(
+        TABLES,
+        table_paths,
+        *schema_paths(),
+        legacy_index="_dta_index_customer_5_949578421__k13_k5",
+        bulk=bulk,
+        generator=generator,
+    )
 
 
 def main():
+    if sys.argv[1:] == ["complete"]:
+        # Exits 0 if the database is fully loaded, so the data need not exist.
+        sys.exit(0 if load_complete(TABLES, *schema_paths()) else 1)
     engine: Engine = create_engine(
         connstr(), execution_options={"isolation_level": "AUTOCOMMIT"}
     )
     with engine.connect() as conn:
-        if not loaded(conn):
-            load(conn)
-            vacuum_full_analyze_all(engine, conn)
+        bulk = int(os.getenv("LOAD_BULK", "0")) == 1
+        generate = int(os.getenv("LOAD_GENERATE", "0")) == 1
+        tables = load(bulk=bulk, generate=generate)
+        # SET LOGGED already rewrote every bulk-loaded table compactly.
+        command = "VACUUM ANALYZE" if bulk else "VACUUM FULL ANALYZE"
+        vacuum_loaded(engine, conn, tables, command)
 
 
 if __name__ == "__main__":
@@ -1,4 +1,7 @@
 from abc import ABC
+from typing import Optional
+
+from tablesample import SamplePolicy, TableSampler
 
 
 class Rewriter(ABC):
@@ -13,3 +16,43 @@ class EARewriter(Rewriter):
         if prefix.startswith("select") or prefix.startswith("with"):
             is_ea, query = True, f"EXPLAIN (ANALYZE, FORMAT JSON, VERBOSE) {query}"
         return query, is_ea
+
+
+class TablesampleRewriter(EARewriter):
+    def __init__(
+        self,
+        sample_method: str,
+        sample_seed: str,
+        nested: bool,
+        policy: Optional[SamplePolicy] = None,
+    ):
+        super().__init__()
+        self.sampler = TableSampler(sample_method, sample_seed, nested, policy)
+
+    def rewrite(self, query_id: str, query_subnum: int, query: str) -> (str, bool):
+        _, is_ea = super().rewrite(query_id, query_subnum, query)
+        if is_ea:
+            query = self.sampler.sample(query)
+        return super().rewrite(query_id, query_subnum, query)
+
+
+class NTSRewriter(TablesampleRewriter):
+    # Samples every table, including those in subqueries.
+    def __init__(
+        self,
+        sample_method: str,
+        sample_seed: str,
+        policy: Optional[SamplePolicy] = None,
+    ):
+        super().__init__(sample_method, sample_seed, nested=True, policy=policy)
+
+
+class STSRewriter(TablesampleRewriter):
+    # Samples only the tables outside of subqueries.
+    def __init__(
+        self,
+        sample_method: str,
+        sample_seed: str,
+        policy: Optional[SamplePolicy] = None,
+    ):
+        super().__init__(sample_method, sample_seed, nested=False, policy=policy)
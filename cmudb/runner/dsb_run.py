@@ -1,16 +1,21 @@
 import os
+import sys
 import time
 import traceback
 from pathlib import Path
 from typing import Optional
 
 import psycopg.errors
-import sqlalchemy.exc
+from corpus import corpus
 from dsb_rewriter import *
+from executor import explain_text, make_pool, make_units, select_configs
+from manifest import Manifest
+from predictor import RuntimePredictor, history_key
+from scheduler import Schedule
+from sink import make_sink
 from sqlalchemy import Connection, Engine, NullPool, create_engine
 from tqdm import tqdm
-from util import (conn_execute, connstr, prewarm_all, sql_file_queries,
-                  vacuum_analyze_all)
+from util import conn_execute, connstr
 
 
 class Config:
@@ -21,153 +26,141 @@ class Config:
         rewriter: Optional[Rewriter] = None,
         before_sql: Optional[list[str]] = None,
         after_sql: Optional[list[str]] = None,
+        teardown_sql: Optional[list[str]] = None,
     ):
         self.expt_name = expt_name
         self.timeout_s = timeout_s
         self.rewriter = rewriter if rewriter is not None else EARewriter()
         self.before_sql = before_sql if before_sql is not None else []
+        # after_sql runs once when every query is done, then teardown_sql runs on
+        # every backend.
         self.after_sql = after_sql if after_sql is not None else []
+        self.teardown_sql = teardown_sql if teardown_sql is not None else []
 
 
 def dsb(engine: Engine, conn: Connection, config: Config, verbose=False):
-    hostname = os.getenv("HOSTNAME")
     artifact_root = Path(os.getenv("ARTIFACT_ROOT"))
     query_root = Path(os.getenv("DSB_QUERY_ROOT"))
     train_seed = int(os.getenv("DSB_QUERY_TRAIN_SEED"))
     test_seed = int(os.getenv("DSB_QUERY_TEST_SEED"))
     dsb_sf = int(os.getenv("DSB_SF"))
 
-    seed_timeouts = {}
-    if dsb_sf > 1:
-        for seed in [train_seed, test_seed]:
-            seed_timeouts[seed] = set()
-            with open(
-                Path(os.getenv("ROOT_DIR"))
-                / "cmudb"
-                / "env"
-                / f"{hostname}_dsb_sf1_timeout_{seed}.txt"
-            ) as f:
-                for line in f:
-                    seed_timeouts[seed].add(str(Path(line).stem))
-            with open(
-                Path(os.getenv("ROOT_DIR"))
-                / "cmudb"
-                / "env"
-                / f"{hostname}_dsb_sf1_runtime_{seed}.txt"
-            ) as f:
-                for line in f:
-                    filename, _, runtime_ms = line.split(":")
-                    # Assume linear scaling.
-                    scaled_runtime_s = (float(runtime_ms) / 1000) * dsb_sf
-                    if scaled_runtime_s >= config.timeout_s:
-                        seed_timeouts[seed].add(str(Path(filename).stem))
+    pin_seed = int(os.getenv("RUNNER_PIN_SEED", "0")) == 1
 
-    readied = False
-    executed_once = False
+    pool = make_pool(engine, conn, config.before_sql, config.timeout_s, verbose)
+    manifest = Manifest(
+        artifact_root / "experiment" / config.expt_name / "dsb" / f"sf_{dsb_sf}"
+    )
+    sink = make_sink(manifest.root)
+    predictor = RuntimePredictor(
+        artifact_root, "dsb", dsb_sf, config.expt_name, config.timeout_s
+    )
+
+    def finished(key: str, state: str, plan: Optional[str] = None):
+        if sink is not None:
+            sink.append(key, state, plan)
+        manifest.record(key, state)
 
     seeds = [train_seed]
     if config.expt_name == "default":
         seeds.append(test_seed)
 
-    for seed in tqdm(seeds, desc=f"{config.expt_name} {dsb_sf} DSB seeds.", leave=None):
-        outdir = (
-            artifact_root
-            / "experiment"
-            / config.expt_name
-            / "dsb"
-            / f"sf_{dsb_sf}"
-            / "default"
-            / str(seed)
-        )
+    def run_unit(unit):
+        seed, query_paths = unit
+        outdir = manifest.root / "default" / str(seed)
         outdir.mkdir(parents=True, exist_ok=True)
 
-        for query_path in tqdm(
-            sorted(
-                (query_root / "default" / str(seed)).glob("*.sql"),
-                key=lambda s: str(s).split("-")[0],
-            ),
-            desc=f"{config.expt_name} {dsb_sf} DSB query.",
-            leave=None,
-        ):
-            query_id = str(query_path.stem)
-            for query_subnum, query in enumerate(
-                sql_file_queries(query_path.absolute()), 1
-            ):
-                outpath_ok = outdir / f"{query_path.stem}-{query_subnum}.ok"
-                outpath_res = outdir / f"{query_path.stem}-{query_subnum}.res"
-                outpath_err = outdir / f"{query_path.stem}-{query_subnum}.err"
-                outpath_timeout = outdir / f"{query_path.stem}-{query_subnum}.timeout"
+        for query_path in query_paths:
+            run_query(outdir, seed, query_path)
 
-                if outpath_err.exists():
-                    continue
+    def run_query(outdir: Path, seed: int, query_path: Path):
+        query_id = str(query_path.stem)
+        for query_subnum, query in enumerate(corpus().queries(query_path), 1):
+            outpath_res = outdir / f"{query_path.stem}-{query_subnum}.res"
+            outpath_err = outdir / f"{query_path.stem}-{query_subnum}.err"
+            outpath_timeout = outdir / f"{query_path.stem}-{query_subnum}.timeout"
+            key = manifest.key(outpath_res)
 
-                if outpath_ok.exists():
-                    continue
+            if key in manifest:
+                continue
 
-                if (
-                    seed in seed_timeouts
-                    and f"{query_path.stem}-{query_subnum}" in seed_timeouts[seed]
-                ):
-                    if config.expt_name == "default":
-                        outpath_timeout.touch(exist_ok=True)
-                        outpath_ok.touch(exist_ok=True)
-                        continue
+            history = history_key("dsb", key)
+            prediction = predictor.predict(history)
+            if prediction.skip:
+                outpath_timeout.touch(exist_ok=True)
+                finished(key, "timeout")
+                predictor.skipped()
+                continue
 
+            query, is_ea = config.rewriter.rewrite(query_id, query_subnum, query)
+            # A query cut by an adaptive timeout is retried with the config's.
+            timeouts_s = [prediction.timeout_s]
+            if prediction.timeout_s < config.timeout_s:
+                timeouts_s.append(config.timeout_s)
+            for timeout_s in timeouts_s:
+                start = time.time()
                 try:
-                    if not readied:
-                        conn_execute(
-                            conn, f"SET statement_timeout = '0s'", verbose=verbose
-                        )
-                        prewarm_all(engine, conn, verbose=verbose)
-                        vacuum_analyze_all(engine, conn, verbose=verbose)
-                        for sql in config.before_sql:
-                            conn_execute(conn, sql, verbose=verbose)
-                        conn_execute(
-                            conn,
-                            f"SET statement_timeout = '{config.timeout_s}s'",
-                            verbose=verbose,
-                        )
-                        readied = True
-                        executed_once = True
-
-                    with open(outpath_res, "w") as output_file:
-                        query, is_ea = config.rewriter.rewrite(
-                            query_id, query_subnum, query
-                        )
-                        result = conn_execute(conn, query, verbose=False)
-                        if is_ea:
-                            ea_result = str(result.fetchone()[0][0])
-                            print(ea_result, file=output_file)
-                        outpath_ok.touch(exist_ok=True)
+                    result = pool.execute(query, fetch=is_ea, timeout_s=timeout_s)
+                    predictor.finished(history, "ok", time.time() - start, timeout_s)
+                    ea_result = explain_text(result) if is_ea else None
+                    pool.write(
+                        outpath_res,
+                        ea_result,
+                        done=lambda key=key, plan=ea_result: finished(key, "ok", plan),
+                    )
+                    break
 
-                except sqlalchemy.exc.OperationalError as e:
-                    if isinstance(e.orig, psycopg.errors.QueryCanceled):
-                        # Since DSB's data distribution varies, timeouts may not be shared.
-                        outpath_timeout.touch(exist_ok=True)
-                        outpath_ok.touch(exist_ok=True)
-                    else:
-                        raise e
-
-                except sqlalchemy.exc.DataError as e:
-                    if isinstance(e.orig, psycopg.errors.DivisionByZero):
-                        with open(outpath_err, "w") as error_file:
-                            traceback.print_exception(e, file=error_file)
-                        outpath_ok.touch(exist_ok=True)
-                    else:
-                        raise e
-
-    if executed_once:
-        for sql in config.after_sql:
-            conn_execute(conn, sql, verbose=verbose)
+                except psycopg.errors.QueryCanceled:
+                    # Since DSB's data distribution varies, timeouts may not be shared.
+                    predictor.finished(
+                        history, "timeout", time.time() - start, timeout_s
+                    )
+                    if timeout_s < config.timeout_s:
+                        continue
+                    pool.write(
+                        outpath_res,
+                        None,
+                        outpath_timeout,
+                        done=lambda key=key: finished(key, "timeout"),
+                    )
 
+                except psycopg.errors.DivisionByZero as e:
+                    with open(outpath_err, "w") as error_file:
+                        traceback.print_exception(e, file=error_file)
+                    pool.write(
+                        outpath_res,
+                        None,
+                        done=lambda key=key: finished(key, "err"),
+                    )
+                    break
 
-def main():
-    engine: Engine = create_engine(
-        connstr(),
-        poolclass=NullPool,
-        execution_options={"isolation_level": "AUTOCOMMIT"},
+    units = make_units(
+        seeds,
+        lambda seed: sorted(
+            (query_root / "default" / str(seed)).glob("*.sql"),
+            key=lambda s: str(s).split("-")[0],
+        ),
+        pin_seed,
     )
+    schedule = Schedule(engine, conn, units, verbose)
+    try:
+        pool.run(
+            schedule.wrap(run_unit),
+            schedule.units,
+            desc=f"{config.expt_name} {dsb_sf} DSB query.",
+        )
+        pool.finish(config.after_sql, config.teardown_sql)
+    finally:
+        pool.close()
+        if sink is not None:
+            sink.close()
+        manifest.close()
+        corpus().save()
+        predictor.report(manifest.root)
+        predictor.close()
+
 
+def make_configs() -> list[Config]:
     def make_bytejack_config(
         enable=False,
         intercept_explain_analyze=False,
@@ -204,10 +197,8 @@ def main():
                 f"SET bytejack.seq_sample_pct={seq_sample_pct}",
                 f"SET bytejack.seq_sample_seed={seq_sample_seed}",
             ],
-            after_sql=[
-                f"SELECT bytejack_save('{name}')",
-                "SELECT bytejack_disconnect()",
-            ],
+            after_sql=[f"SELECT bytejack_save('{name}')"],
+            teardown_sql=["SELECT bytejack_disconnect()"],
         )
 
     configs = [
@@ -241,6 +232,18 @@ def main():
                                          early_stop=True, seq_sample=True, seq_sample_pct=pct, seq_sample_seed=ssseed),
                 )
 
+    return configs
+
+
+def main():
+    engine: Engine = create_engine(
+        connstr(),
+        poolclass=NullPool,
+        execution_options={"isolation_level": "AUTOCOMMIT"},
+    )
+
+    configs = select_configs(make_configs())
+    failed = []
     pbar = tqdm(range(len(configs)), desc="Configs.", leave=None)
     for config in configs:
         time.time()
@@ -257,9 +260,14 @@ def main():
         except Exception:
             traceback.print_exc()
             print(f"ERROR FOR CONFIG: {config.expt_name}")
-            pass
+            failed.append(config.expt_name)
         pbar.update()
     pbar.close()
+    # The remaining configs still run, but callers (e.g., the orchestrator) see
+    # that one failed.
+    if len(failed) > 0:
+        print(f"FAILED CONFIGS: {failed}")
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,224 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Callable, Optional
+
+import sqlalchemy.exc
+from psycopg.types.string import TextLoader
+from sqlalchemy import Connection, Engine
+from tqdm import tqdm
+from util import conn_execute, prewarm_nonresident, vacuum_analyze_changed
+
+
+# RUNNER_PLAN_FETCH=text fetches EXPLAIN (FORMAT JSON) output as the server's
+# text, which is written to .res files and the sink as-is. Plans are then only
+# ever parsed when they are analyzed. RUNNER_PLAN_FETCH=json decodes them into
+# Python objects and re-encodes them.
+PLAN_FETCHES = ["json", "text"]
+
+
+def use_text_plans(dbapi_conn):
+    # Applies to this connection only; other connections still decode json.
+    dbapi_conn.adapters.register_loader("json", TextLoader)
+
+
+def explain_text(result) -> str:
+    # EXPLAIN (FORMAT JSON) returns a one-element array; .res files hold the
+    # element itself.
+    if isinstance(result, str):
+        return result[result.index("{") : result.rindex("}") + 1]
+    return json.dumps(result[0])
+
+
+def write_result(
+    outpath_res: Path,
+    contents: Optional[str],
+    touch_paths: list[Path],
+    done: Optional[Callable[[], None]] = None,
+):
+    with open(outpath_res, "w") as output_file:
+        if contents is not None:
+            print(contents, file=output_file)
+    for path in touch_paths:
+        path.touch(exist_ok=True)
+    if done is not None:
+        done()
+
+
+class WorkerPool:
+    def __init__(
+        self,
+        engine: Engine,
+        conn: Connection,
+        before_sql: list[str],
+        timeout_s: int,
+        num_workers: int = 1,
+        verbose=False,
+    ):
+        self.engine = engine
+        self.conn = conn
+        self.before_sql = before_sql
+        self.timeout_s = timeout_s
+        self.num_workers = max(1, num_workers)
+        self.verbose = verbose
+        self.plan_fetch = os.getenv("RUNNER_PLAN_FETCH", "json")
+        if self.plan_fetch not in PLAN_FETCHES:
+            raise Exception(f"Unknown RUNNER_PLAN_FETCH: {self.plan_fetch}")
+
+        # conns[0] is the caller's connection, the rest are opened on ready().
+        self.conns = [conn]
+        self.readied = False
+        self.ready_lock = threading.Lock()
+        self.assign_lock = threading.Lock()
+        self.assigned = 0
+        self.local = threading.local()
+        # Some queries create global objects (e.g., TPC-H Q15's revenue0 view).
+        self.exclusive_lock = threading.Lock()
+
+    def ready(self):
+        with self.ready_lock:
+            if self.readied:
+                return
+            conn_execute(
+                self.conn, f"SET statement_timeout = '0s'", verbose=self.verbose
+            )
+            prewarm_nonresident(
+                self.engine,
+                self.conn,
+                num_workers=int(os.getenv("RUNNER_PREWARM_WORKERS", "4")),
+                verbose=self.verbose,
+            )
+            vacuum_analyze_changed(self.engine, self.conn, verbose=self.verbose)
+            # Set up every backend before any query runs, since before_sql may
+            # reset shared state (e.g., bytejack_cache_clear()).
+            self.setup()
+            self.readied = True
+
+    def setup(self):
+        for _ in range(1, self.num_workers):
+            self.conns.append(self.engine.connect())
+        for conn in self.conns:
+            if self.plan_fetch == "text":
+                use_text_plans(conn.connection.dbapi_connection)
+            for sql in self.before_sql:
+                conn_execute(conn, sql, verbose=self.verbose)
+            conn_execute(
+                conn,
+                f"SET statement_timeout = '{self.timeout_s}s'",
+                verbose=self.verbose,
+            )
+
+    def connection(self):
+        self.ready()
+        if not hasattr(self.local, "conn"):
+            with self.assign_lock:
+                self.local.conn = self.conns[self.assigned]
+                self.assigned += 1
+        return self.local.conn
+
+    def execute(self, sql: str, fetch=False, timeout_s: Optional[float] = None):
+        # A per-query statement_timeout is only sent when it changes.
+        timeout_s = self.timeout_s if timeout_s is None else timeout_s
+        if getattr(self.local, "timeout_s", self.timeout_s) != timeout_s:
+            self.run_sql(f"SET statement_timeout = '{int(timeout_s * 1000)}ms'")
+            self.local.timeout_s = timeout_s
+        return self.run_sql(sql, fetch)
+
+    def run_sql(self, sql: str, fetch=False):
+        # Errors are surfaced as psycopg errors regardless of the backend.
+        try:
+            result = conn_execute(self.connection(), sql, verbose=False)
+        except sqlalchemy.exc.DBAPIError as e:
+            raise e.orig from e
+        return result.fetchone()[0] if fetch else None
+
+    def write(
+        self,
+        outpath_res: Path,
+        contents: Optional[str],
+        *touch_paths: Path,
+        done: Optional[Callable[[], None]] = None,
+    ):
+        write_result(outpath_res, contents, list(touch_paths), done)
+
+    def exclusive(self):
+        return self.exclusive_lock if self.num_workers > 1 else nullcontext()
+
+    def run(self, fn, units, desc: str):
+        if self.num_workers == 1:
+            for unit in tqdm(units, desc=desc, leave=None):
+                fn(unit)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            futures = [executor.submit(fn, unit) for unit in units]
+            try:
+                for future in tqdm(futures, desc=desc, leave=None):
+                    future.result()
+            except BaseException:
+                executor.shutdown(wait=True, cancel_futures=True)
+                raise
+
+    def finish(self, after_sql: list[str], teardown_sql: Optional[list[str]] = None):
+        # Every backend ran before_sql, so every backend is torn down, but shared
+        # state (e.g., bytejack_save()) is only acted on once.
+        if self.readied:
+            for sql in after_sql:
+                conn_execute(self.conns[0], sql, verbose=self.verbose)
+            for conn in self.conns:
+                for sql in teardown_sql or []:
+                    conn_execute(conn, sql, verbose=self.verbose)
+
+    def close(self):
+        for conn in self.conns[1:]:
+            conn.close()
+        self.conns = self.conns[:1]
+
+
+def make_pool(
+    engine: Engine,
+    conn: Connection,
+    before_sql: list[str],
+    timeout_s: int,
+    verbose=False,
+) -> WorkerPool:
+    backend = os.getenv("RUNNER_BACKEND", "sync")
+    num_workers = int(os.getenv("RUNNER_WORKERS", "1"))
+    if backend == "sync":
+        pool_class = WorkerPool
+    elif backend == "async":
+        from async_executor import AsyncWorkerPool
+
+        pool_class = AsyncWorkerPool
+    else:
+        raise Exception(f"Unknown RUNNER_BACKEND: {backend}")
+    return pool_class(
+        engine, conn, before_sql, timeout_s, num_workers=num_workers, verbose=verbose
+    )
+
+
+def make_units(seeds: list, query_paths_fn, pin_seed: bool):
+    # A unit is (seed, [query_path, ...]) and always runs on a single backend.
+    units = []
+    for seed in seeds:
+        query_paths = query_paths_fn(seed)
+        if pin_seed:
+            units.append((seed, query_paths))
+        else:
+            units.extend((seed, [query_path]) for query_path in query_paths)
+    return units
+
+
+def select_configs(configs: list) -> list:
+    # RUNNER_CONFIGS is a comma-separated list of expt_names, empty for all.
+    names = [name for name in os.getenv("RUNNER_CONFIGS", "").split(",") if name]
+    if len(names) == 0:
+        return configs
+    by_name = {config.expt_name: config for config in configs}
+    unknown = [name for name in names if name not in by_name]
+    if len(unknown) > 0:
+        raise Exception(f"Unknown RUNNER_CONFIGS: {unknown}")
+    return [by_name[name] for name in names]
@@ -0,0 +1,305 @@
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+# A compact gradient-boosted tree model that is trained and evaluated with
+# NumPy alone, so that predictions are cheap enough for per-query decisions.
+# Boosting minimizes absolute error (sign gradients, median leaves). Features
+# are the same columns as the AutoGluon predictors: numerics as float32 and
+# categoricals as their dictionary codes, with NaN for missing values.
+#
+# Splits are found on quantile bins, but stored as raw-value thresholds. A row
+# goes left if its value is <= the threshold; NaN compares false and goes right,
+# which is also where training put the NaN bin. All trees are stored in flat
+# arrays and traversed together, one level per step, so inference is a handful
+# of vectorized gathers regardless of the number of trees.
+MAX_BINS = 255
+
+
+class FastModel:
+    def __init__(
+        self,
+        cols: list[str],
+        categories: dict[str, list[str]],
+        base: float,
+        feature: np.ndarray,
+        threshold: np.ndarray,
+        left: np.ndarray,
+        right: np.ndarray,
+        value: np.ndarray,
+        roots: np.ndarray,
+        depth: int,
+    ):
+        self.cols = cols
+        self.categories = categories
+        self.codes = {
+            col: {category: i for i, category in enumerate(values)}
+            for col, values in categories.items()
+        }
+        self.base = base
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.depth = depth
+
+    def matrix(self, frame) -> np.ndarray:
+        return frame_matrix(frame, self.cols, self.codes)
+
+    def operators_matrix(self, operators: list[dict]) -> np.ndarray:
+        # Shredded plan nodes, e.g., from a plan that has not been run.
+        x = np.full((len(operators), len(self.cols)), np.nan, dtype=np.float32)
+        for j, col in enumerate(self.cols):
+            codes = self.codes.get(col)
+            for i, operator in enumerate(operators):
+                value = operator.get(col)
+                if value is None:
+                    continue
+                if codes is not None:
+                    value = codes.get(str(value))
+                    if value is None:
+                        continue
+                x[i, j] = float(value)
+        return x
+
+    def predict_matrix(self, x: np.ndarray) -> np.ndarray:
+        rows = np.arange(len(x))[:, None]
+        node = np.broadcast_to(self.roots, (len(x), len(self.roots)))
+        for _ in range(self.depth):
+            feature = self.feature[node]
+            leaf = feature < 0
+            go_left = x[rows, np.where(leaf, 0, feature)] <= self.threshold[node]
+            node = np.where(
+                leaf, node, np.where(go_left, self.left[node], self.right[node])
+            )
+        return self.base + self.value[node].sum(axis=1, dtype=np.float64)
+
+    def predict(self, frame) -> np.ndarray:
+        return self.predict_matrix(self.matrix(frame))
+
+    def predict_operators(self, operators: list[dict]) -> np.ndarray:
+        return self.predict_matrix(self.operators_matrix(operators))
+
+    def save(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        arrays = {
+            "cols": np.array(self.cols, dtype=str),
+            "categorical": np.array(
+                [col for col in self.cols if col in self.categories], dtype=str
+            ),
+            "base": np.array(self.base),
+            "feature": self.feature,
+            "threshold": self.threshold,
+            "left": self.left,
+            "right": self.right,
+            "value": self.value,
+            "roots": self.roots,
+            "depth": np.array(self.depth),
+        }
+        for i, col in enumerate(arrays["categorical"]):
+            arrays[f"categories_{i}"] = np.array(self.categories[col], dtype=str)
+        tmp_path = path.with_name(f"{path.name}.tmp.npz")
+        np.savez(tmp_path, **arrays)
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> "FastModel":
+        with np.load(path) as f:
+            categories = {
+                str(col): f[f"categories_{i}"].tolist()
+                for i, col in enumerate(f["categorical"])
+            }
+            return cls(
+                f["cols"].tolist(),
+                categories,
+                float(f["base"]),
+                f["feature"],
+                f["threshold"],
+                f["left"],
+                f["right"],
+                f["value"],
+                f["roots"],
+                int(f["depth"]),
+            )
+
+    @classmethod
+    def fit(
+        cls,
+        frame,
+        cols: list[str],
+        target_col: str,
+        num_trees: int = 100,
+        max_depth: int = 6,
+        learning_rate: float = 0.1,
+        min_leaf_rows: int = 20,
+        max_rows: int = 200000,
+        seed: int = 15721,
+    ) -> "FastModel":
+        categories = {
+            col: [str(category) for category in frame[col].cat.categories]
+            for col in cols
+            if hasattr(frame[col], "cat")
+        }
+        x = frame_matrix(frame, cols, None)
+        y = frame[target_col].to_numpy(dtype=np.float64)
+        if len(y) > max_rows:
+            sample = np.sort(
+                np.random.default_rng(seed).choice(len(y), max_rows, replace=False)
+            )
+            x, y = x[sample], y[sample]
+
+        # Bin b < num_bins covers (edges[b - 1], edges[b]]; the last bin is NaN.
+        edges = []
+        bins = np.empty(x.shape, dtype=np.uint8)
+        for j in range(len(cols)):
+            values = x[:, j]
+            present = values[~np.isnan(values)]
+            col_edges = np.unique(
+                np.quantile(present, np.linspace(0, 1, MAX_BINS)[1:])
+                if len(present) > 0
+                else np.empty(0)
+            ).astype(np.float32)
+            edges.append(col_edges)
+            col_bins = np.searchsorted(col_edges, values, side="left")
+            col_bins[np.isnan(values)] = MAX_BINS
+            bins[:, j] = np.minimum(col_bins, MAX_BINS)
+
+        base = float(np.median(y)) if len(y) > 0 else 0.0
+        prediction = np.full(len(y), base)
+        trees = []
+        for _ in range(num_trees):
+            residual = y - prediction
+            tree, leaf_of_row = grow_tree(
+                bins, np.sign(residual), max_depth, min_leaf_rows
+            )
+            feature, bin_threshold, left, right = tree
+            value = np.zeros(len(feature), dtype=np.float32)
+            for node in np.flatnonzero(feature < 0):
+                rows = leaf_of_row == node
+                if rows.any():
+                    value[node] = learning_rate * np.median(residual[rows])
+            prediction += value[leaf_of_row]
+            threshold = np.zeros(len(feature), dtype=np.float32)
+            for node in np.flatnonzero(feature >= 0):
+                col_edges = edges[feature[node]]
+                # Every value in bins <= t is <= edges[t]; the last bin is open.
+                t = bin_threshold[node]
+                threshold[node] = col_edges[t] if t < len(col_edges) else np.inf
+            trees.append((feature, threshold, left, right, value))
+
+        offsets = np.cumsum([0] + [len(tree[0]) for tree in trees])
+        return cls(
+            cols,
+            categories,
+            base,
+            np.concatenate([tree[0] for tree in trees]).astype(np.int16),
+            np.concatenate([tree[1] for tree in trees]),
+            np.concatenate(
+                [tree[2] + offset for tree, offset in zip(trees, offsets)]
+            ).astype(np.int32),
+            np.concatenate(
+                [tree[3] + offset for tree, offset in zip(trees, offsets)]
+            ).astype(np.int32),
+            np.concatenate([tree[4] for tree in trees]),
+            offsets[:-1].astype(np.int32),
+            max_depth,
+        )
+
+
+def frame_matrix(frame, cols: list[str], codes: Optional[dict]) -> np.ndarray:
+    # frame is a feature store slice. Category columns become codes: the frame's
+    # own when fitting (codes is None), otherwise the codes the model was fit
+    # with, since a rebuilt store may number its categories differently.
+    # Categories the model has not seen are missing.
+    x = np.empty((len(frame), len(cols)), dtype=np.float32)
+    for j, col in enumerate(cols):
+        series = frame[col]
+        if hasattr(series, "cat"):
+            frame_codes = series.array.codes
+            if codes is not None:
+                col_codes = codes.get(col, {})
+                lookup = [col_codes.get(str(c), -1) for c in series.cat.categories]
+                frame_codes = np.array(lookup + [-1], dtype=np.int64)[frame_codes]
+            x[:, j] = np.where(frame_codes < 0, np.nan, frame_codes)
+        else:
+            x[:, j] = series.to_numpy(dtype=np.float32, na_value=np.nan)
+    return x
+
+
+def grow_tree(bins: np.ndarray, gradient: np.ndarray, max_depth: int, min_rows: int):
+    # Grows one tree level by level on binned features. Returns the tree as
+    # (feature, bin threshold, left, right) arrays, with feature -1 for leaves
+    # and children pointing at themselves, and the leaf each row ends up in.
+    num_rows, num_features = bins.shape
+    num_bins = MAX_BINS + 1
+    feature = [-1]
+    threshold = [0]
+    left = [0]
+    right = [0]
+    node_of_row = np.zeros(num_rows, dtype=np.int64)
+    level = [0]
+    feature_offsets = np.arange(num_features) * num_bins
+
+    for _ in range(max_depth):
+        if len(level) == 0:
+            break
+        slot = np.full(len(feature), -1)
+        slot[level] = np.arange(len(level))
+        row_slot = slot[node_of_row]
+        active = row_slot >= 0
+        keys = (
+            row_slot[active, None] * (num_features * num_bins)
+            + feature_offsets
+            + bins[active]
+        ).ravel()
+        size = len(level) * num_features * num_bins
+        shape = (len(level), num_features, num_bins)
+        grad_hist = np.bincount(
+            keys, weights=np.repeat(gradient[active], num_features), minlength=size
+        ).reshape(shape)
+        count_hist = np.bincount(keys, minlength=size).reshape(shape)
+
+        # Left holds bins 0..t for t < MAX_BINS, so NaN always goes right.
+        grad_left = np.cumsum(grad_hist, axis=2)[:, :, :MAX_BINS]
+        count_left = np.cumsum(count_hist, axis=2)[:, :, :MAX_BINS]
+        grad_total = grad_hist.sum(axis=2)[:, 0, None, None]
+        count_total = count_hist.sum(axis=2)[:, 0, None, None]
+        grad_right = grad_total - grad_left
+        count_right = count_total - count_left
+        valid = (count_left >= min_rows) & (count_right >= min_rows)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            gain = (
+                grad_left**2 / count_left
+                + grad_right**2 / count_right
+                - grad_total**2 / count_total
+            )
+        gain = np.where(valid, gain, -np.inf)
+
+        next_level = []
+        for i, node in enumerate(level):
+            best = np.argmax(gain[i])
+            best_feature, best_bin = divmod(best, MAX_BINS)
+            if not np.isfinite(gain[i].flat[best]) or gain[i].flat[best] <= 1e-12:
+                continue
+            feature[node] = best_feature
+            threshold[node] = best_bin
+            left[node] = len(feature)
+            right[node] = len(feature) + 1
+            for _ in range(2):
+                next_level.append(len(feature))
+                feature.append(-1)
+                threshold.append(0)
+                left.append(len(feature) - 1)
+                right.append(len(feature) - 1)
+            rows = node_of_row == node
+            go_left = bins[rows, best_feature] <= best_bin
+            node_of_row[rows] = np.where(go_left, left[node], right[node])
+        level = next_level
+
+    return (
+        (np.array(feature), np.array(threshold), np.array(left), np.array(right)),
+        node_of_row,
+    )
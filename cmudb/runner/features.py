@@ -0,0 +1,171 @@
+import hashlib
+import os
+import shutil
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import ujson
+
+# The model's feature columns, encoded once per (benchmark, SF) and saved as one
+# .npy file per column: float32 for numeric (and boolean) columns, dictionary
+# codes of the smallest int type for everything else. The target column is kept
+# as float64 so that labels are unchanged. Rows are grouped so that every
+# experiment's training rows and the shared test rows are each one contiguous
+# range, which makes every slice a view of the memory-mapped files.
+#
+# A saved store is reused while its signature matches. The signature covers the
+# shredded sources (the operator cache's sources.json), the columns and the
+# train/test seeds.
+FEATURES_DIR = "features"
+META_NAME = "meta.json"
+INDEX_NAME = "index.npy"
+FEATURES_VERSION = 2
+TEST_GROUP = "test"
+
+
+def code_dtype(num_categories: int):
+    # pandas stores codes in the smallest int type that fits, so codes saved in
+    # that type are used as-is instead of being cast.
+    for dtype in [np.int8, np.int16, np.int32]:
+        if num_categories < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def is_numeric(series: pd.Series) -> bool:
+    # Categoricals are the dictionary-encoded string columns of load_results.
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return False
+    if pd.api.types.is_bool_dtype(series) or pd.api.types.is_numeric_dtype(series):
+        return True
+    values = series.dropna()
+    return len(values) > 0 and values.map(lambda v: isinstance(v, bool)).all()
+
+
+def encode(series: pd.Series) -> tuple[np.ndarray, Optional[list[str]]]:
+    if is_numeric(series):
+        return series.astype("float32").to_numpy(na_value=np.nan), None
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # Recodes load_results' dictionaries to their observed categories in
+        # sorted order, which is what factorize gives for plain strings.
+        series = series.cat.remove_unused_categories()
+        categories, recode = np.unique(
+            series.cat.categories.astype(str).to_numpy(dtype=object),
+            return_inverse=True,
+        )
+        # Missing values (code -1) pick the -1 appended at the end.
+        codes = np.append(recode, -1)[series.cat.codes.to_numpy()]
+        return codes.astype(code_dtype(len(categories))), categories.tolist()
+    codes, categories = pd.factorize(series.map(str, na_action="ignore"), sort=True)
+    return codes.astype(code_dtype(len(categories))), categories.tolist()
+
+
+def signature(
+    sources_path: Path, cols: list[str], target_col: str, train_seeds, test_seeds
+) -> str:
+    hasher = hashlib.blake2b(digest_size=16)
+    with open(sources_path, "rb") as f:
+        hasher.update(f.read())
+    key = [FEATURES_VERSION, cols, target_col, sorted(train_seeds), sorted(test_seeds)]
+    hasher.update(ujson.dumps(key).encode())
+    return hasher.hexdigest()
+
+
+class FeatureStore:
+    def __init__(self, root: Path):
+        self.root = root
+        with open(root / META_NAME) as f:
+            self.meta = ujson.load(f)
+        self.index = np.load(root / INDEX_NAME, mmap_mode="r")
+        self.columns = {}
+        for i, column in enumerate(self.meta["columns"]):
+            values = np.load(root / f"{i}.npy", mmap_mode="r")
+            dtype = None
+            if column["categories"] is not None:
+                dtype = pd.CategoricalDtype(pd.Index(column["categories"]))
+            self.columns[column["name"]] = (values, dtype)
+
+    def slice(self, start: int, stop: int) -> pd.DataFrame:
+        data = {}
+        for name, (values, dtype) in self.columns.items():
+            if dtype is None:
+                data[name] = values[start:stop]
+            else:
+                data[name] = pd.Categorical.from_codes(values[start:stop], dtype=dtype)
+        return pd.DataFrame(data, index=self.index[start:stop], copy=False)
+
+    def group(self, name: str) -> pd.DataFrame:
+        start, stop = self.meta["groups"].get(name, [0, 0])
+        return self.slice(start, stop)
+
+    def train(self, expt: str) -> pd.DataFrame:
+        return self.group(f"train/{expt}")
+
+    def test(self) -> pd.DataFrame:
+        return self.group(TEST_GROUP)
+
+
+def build(
+    root: Path,
+    df: pd.DataFrame,
+    cols: list[str],
+    target_col: str,
+    train_seeds,
+    test_seeds,
+    sig: str,
+):
+    # Same row selection as model.main: the default experiment's test seeds for
+    # testing, and each experiment's train seeds for training.
+    included = df["Exclude"] == False
+    groups = {TEST_GROUP: included & df["Seed"].isin(test_seeds)}
+    groups[TEST_GROUP] &= df["Experiment"] == "default"
+    for expt in df["Experiment"].unique():
+        groups[f"train/{expt}"] = (
+            included & df["Seed"].isin(train_seeds) & (df["Experiment"] == expt)
+        )
+
+    positions = []
+    ranges = {}
+    for name, mask in groups.items():
+        rows = np.flatnonzero(mask.to_numpy())
+        ranges[name] = [len(positions), len(positions) + len(rows)]
+        positions.extend(rows.tolist())
+    rows_df = df.iloc[positions]
+
+    tmp_root = root.with_name(f"{root.name}.tmp{os.getpid()}")
+    shutil.rmtree(tmp_root, ignore_errors=True)
+    tmp_root.mkdir(parents=True)
+    np.save(tmp_root / INDEX_NAME, rows_df.index.to_numpy(dtype=np.int64))
+    columns = []
+    for i, col in enumerate(cols + [target_col]):
+        if col == target_col:
+            values, categories = rows_df[col].to_numpy(dtype=np.float64), None
+        else:
+            values, categories = encode(rows_df[col])
+        np.save(tmp_root / f"{i}.npy", values)
+        columns.append({"name": col, "categories": categories})
+    with open(tmp_root / META_NAME, "w") as f:
+        ujson.dump({"signature": sig, "columns": columns, "groups": ranges}, f)
+    shutil.rmtree(root, ignore_errors=True)
+    os.replace(tmp_root, root)
+
+
+def load_features(
+    cache_root: Path,
+    df: pd.DataFrame,
+    cols: list[str],
+    target_col: str,
+    train_seeds,
+    test_seeds,
+) -> FeatureStore:
+    root = cache_root / FEATURES_DIR
+    sources_path = cache_root / "sources.json"
+    sig = signature(sources_path, cols, target_col, train_seeds, test_seeds)
+    if (root / META_NAME).exists():
+        with open(root / META_NAME) as f:
+            if ujson.load(f)["signature"] == sig:
+                return FeatureStore(root)
+    build(root, df, cols, target_col, train_seeds, test_seeds, sig)
+    return FeatureStore(root)
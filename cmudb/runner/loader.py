@@ -0,0 +1,430 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import pglast
+import psycopg
+from catalog import (CATALOG_TABLE, catalog_entries, ensure_catalog,
+                     file_checksum, forget, is_current, mark_vacuumed,
+                     new_hasher, record, unvacuumed)
+from pglast.enums import AlterTableType, ConstrType
+from sqlalchemy import Connection, Engine
+from util import conninfo, sql_file_queries, vacuum_tables
+
+COPY_BLOCK_SIZE = 1 << 20
+
+
+def copy_sql(table: str) -> str:
+    return f"COPY {table} FROM STDIN CSV DELIMITER '|'"
+
+
+def copy_stream(cur: psycopg.Cursor, table: str, f, hasher=None) -> int:
+    num_bytes = 0
+    with cur.copy(copy_sql(table)) as copy:
+        while data := f.read(COPY_BLOCK_SIZE):
+            copy.write(data)
+            if hasher is not None:
+                hasher.update(data)
+            num_bytes += len(data)
+    return num_bytes
+
+
+def copy_table(table: str, table_path: Path, verbose=True) -> dict:
+    # Client-side COPY: the file only has to be readable by this process.
+    # The file is checksummed as it streams, and the table's catalog row is
+    # written in the same transaction as its rows.
+    if verbose:
+        print(f"{copy_sql(table)} < {table_path}")
+    start = time.time()
+    hasher = new_hasher()
+    source_stat = table_path.stat()
+    with psycopg.connect(conninfo(), autocommit=True) as conn:
+        conn.execute("SET statement_timeout = '0s'")
+        with conn.transaction(), conn.cursor() as cur:
+            with open(table_path, "rb") as f:
+                num_bytes = copy_stream(cur, table, f, hasher)
+            num_rows = cur.rowcount
+            record(
+                conn,
+                "table",
+                table,
+                table_path,
+                source_stat,
+                hasher.hexdigest(),
+                num_rows,
+            )
+    elapsed_s = time.time() - start
+    return {
+        "Table": table,
+        "Rows": num_rows,
+        "Bytes": num_bytes,
+        "Seconds": elapsed_s,
+        "MB/s": num_bytes / (1 << 20) / max(elapsed_s, 1e-9),
+    }
+
+
+def copy_tables(table_paths: list[tuple[str, Path]], verbose=True) -> list[dict]:
+    # Largest files are submitted first so that they do not end up as the tail.
+    num_workers = int(os.getenv("LOAD_WORKERS", "4"))
+    table_paths = sorted(table_paths, key=lambda tp: tp[1].stat().st_size, reverse=True)
+    with ThreadPoolExecutor(max_workers=max(1, num_workers)) as executor:
+        futures = [
+            executor.submit(copy_table, table, table_path, verbose=verbose)
+            for table, table_path in table_paths
+        ]
+        stats = [future.result() for future in futures]
+    report_copy(stats)
+    return stats
+
+
+def report_copy(stats: list[dict]):
+    for stat in stats:
+        print(
+            f"{stat['Table']:<24} {stat['Rows']:>12} rows "
+            f"{stat['Bytes'] / (1 << 20):>10.1f} MB "
+            f"{stat['Seconds']:>8.1f} s {stat['MB/s']:>8.1f} MB/s"
+        )
+
+
+def fk_graph(conn: psycopg.Connection) -> dict[str, set[str]]:
+    # referencing table -> referenced tables, for foreign keys in the current schema.
+    rows = conn.execute(
+        "SELECT c.conrelid::regclass::text, c.confrelid::regclass::text "
+        "FROM pg_constraint c JOIN pg_namespace n ON n.oid = c.connamespace "
+        "WHERE c.contype = 'f' AND n.nspname = current_schema()"
+    ).fetchall()
+    graph = {}
+    for referencing, referenced in rows:
+        if referencing != referenced:
+            graph.setdefault(referencing, set()).add(referenced)
+    return graph
+
+
+def referenced_first(tables: list[str], graph: dict[str, set[str]]) -> list[str]:
+    ordered = []
+    visited = set()
+
+    def visit(table):
+        if table in visited:
+            return
+        visited.add(table)
+        for referenced in sorted(graph.get(table, set())):
+            visit(referenced)
+        if table in tables:
+            ordered.append(table)
+
+    for table in tables:
+        visit(table)
+    return ordered
+
+
+def referencing_closure(tables: list[str], graph: dict[str, set[str]]) -> set[str]:
+    # TRUNCATE ... CASCADE empties every table that references a truncated one.
+    closed = set(tables)
+    changed = True
+    while changed:
+        changed = False
+        for referencing, referenced in graph.items():
+            if referencing not in closed and len(referenced & closed) > 0:
+                closed.add(referencing)
+                changed = True
+    return closed
+
+
+def fk_waves(tables: list[str], graph: dict[str, set[str]]) -> list[list[str]]:
+    # With foreign keys already in place, a table can only be loaded once the
+    # tables it references are. Without them, this is a single wave.
+    waves = []
+    remaining = list(tables)
+    while len(remaining) > 0:
+        wave = [
+            table
+            for table in remaining
+            if len(graph.get(table, set()) & set(remaining)) == 0
+        ]
+        assert len(wave) > 0, f"Foreign key cycle among: {remaining}"
+        waves.append(wave)
+        remaining = [table for table in remaining if table not in wave]
+    return waves
+
+
+def set_logged(tables: list[str], logged: bool, verbose=True):
+    # A logged table may not reference an unlogged one, so referenced tables are
+    # switched to LOGGED first and to UNLOGGED last.
+    with psycopg.connect(conninfo(), autocommit=True) as conn:
+        conn.execute("SET statement_timeout = '0s'")
+        ordered = referenced_first(tables, fk_graph(conn))
+        if not logged:
+            ordered = list(reversed(ordered))
+        for table in ordered:
+            sql = f"ALTER TABLE {table} SET {'LOGGED' if logged else 'UNLOGGED'}"
+            if verbose:
+                print(sql)
+            conn.execute(sql)
+
+
+def classify(sql: str) -> tuple[str, set[str], set[str]]:
+    # (kind, tables locked, tables whose unique keys it needs)
+    stmts = pglast.parse_sql(sql)
+    if len(stmts) == 1:
+        stmt = stmts[0].stmt
+        if isinstance(stmt, pglast.ast.IndexStmt):
+            kind = "unique index" if stmt.unique else "index"
+            return kind, {stmt.relation.relname}, set()
+        if (
+            isinstance(stmt, pglast.ast.AlterTableStmt)
+            and len(stmt.cmds) == 1
+            and stmt.cmds[0].subtype == AlterTableType.AT_AddConstraint
+            and stmt.cmds[0].def_.contype == ConstrType.CONSTR_FOREIGN
+        ):
+            referenced = stmt.cmds[0].def_.pktable.relname
+            return "fk", {stmt.relation.relname, referenced}, {referenced}
+    return "other", set(), set()
+
+
+def statement_deps(sqls: list[str]) -> list[set[int]]:
+    # Index builds only take SHARE locks and can all run at once. A foreign key
+    # waits for earlier unique indexes on the table it references, and for
+    # earlier foreign keys sharing a table with it, since those would otherwise
+    # queue on (or deadlock over) SHARE ROW EXCLUSIVE locks. Anything else is a
+    # barrier, as in the original sequential order.
+    classified = [classify(sql) for sql in sqls]
+    deps = []
+    for j, (kind_j, locked_j, needs_j) in enumerate(classified):
+        deps_j = set()
+        for i, (kind_i, locked_i, _) in enumerate(classified[:j]):
+            if kind_i == "other" or kind_j == "other":
+                deps_j.add(i)
+            elif kind_j == "fk" and kind_i == "fk" and locked_i & locked_j:
+                deps_j.add(i)
+            elif kind_j == "fk" and kind_i == "unique index" and locked_i & needs_j:
+                deps_j.add(i)
+        deps.append(deps_j)
+    return deps
+
+
+def execute_statement(sql: str, deps: list, verbose=True) -> dict:
+    for dep in deps:
+        dep.result()
+    if verbose:
+        print(sql)
+    start = time.time()
+    with psycopg.connect(conninfo(), autocommit=True) as conn:
+        conn.execute("SET statement_timeout = '0s'")
+        try:
+            conn.execute(sql)
+        except (psycopg.errors.DuplicateTable, psycopg.errors.DuplicateObject):
+            # Built by an earlier load that was interrupted before finishing.
+            if verbose:
+                print(f"Already exists, skipped: {sql}")
+    return {"SQL": sql, "Seconds": time.time() - start}
+
+
+def execute_dag(sqls: list[str], verbose=True) -> list[dict]:
+    # Dependencies always point at earlier statements and the executor is FIFO,
+    # so a statement waiting on its dependencies never starves them of threads.
+    num_workers = int(os.getenv("LOAD_WORKERS", "4"))
+    futures = []
+    with ThreadPoolExecutor(max_workers=max(1, num_workers)) as executor:
+        for sql, deps in zip(sqls, statement_deps(sqls)):
+            futures.append(
+                executor.submit(
+                    execute_statement,
+                    sql,
+                    [futures[i] for i in sorted(deps)],
+                    verbose=verbose,
+                )
+            )
+        stats = [future.result() for future in futures]
+    for stat in stats:
+        print(f"{stat['Seconds']:>8.1f} s {stat['SQL']}")
+    return stats
+
+
+def create_schema(
+    conn: psycopg.Connection, tables: list[str], schema_path: Path, verbose=True
+):
+    with conn.transaction():
+        for table in tables:
+            conn.execute(f"DROP TABLE IF EXISTS {table} CASCADE")
+        for sql in sql_file_queries(schema_path):
+            if verbose:
+                print(sql)
+            conn.execute(sql)
+        forget(conn, "table")
+        forget(conn, "post_load")
+        record(
+            conn,
+            "schema",
+            schema_path.name,
+            schema_path,
+            schema_path.stat(),
+            file_checksum(schema_path),
+        )
+
+
+def adopt_legacy(
+    conn: psycopg.Connection,
+    paths: dict[str, Path],
+    schema_path: Path,
+    post_load_path: Path,
+    legacy_index: str,
+    verbose=True,
+):
+    # Databases loaded before the catalog existed were only marked complete by
+    # one of the last indexes that their post-load statements create.
+    exists = conn.execute(
+        "SELECT 1 FROM pg_indexes WHERE indexname = %s", (legacy_index,)
+    ).fetchone()
+    if exists is None:
+        return
+    if verbose:
+        print(f"Adopting legacy load, found index {legacy_index}.")
+    with conn.transaction():
+        for kind, path in [("schema", schema_path), ("post_load", post_load_path)]:
+            record(conn, kind, path.name, path, path.stat(), file_checksum(path))
+        for table, path in paths.items():
+            record(conn, "table", table, path, path.stat(), file_checksum(path))
+        mark_vacuumed(conn, list(paths))
+
+
+def intact(conn: psycopg.Connection, table: str, entry: dict) -> bool:
+    # Crash recovery empties UNLOGGED tables, and a table that is still UNLOGGED
+    # belongs to a bulk load that never reached SET LOGGED.
+    persistence = conn.execute(
+        "SELECT relpersistence FROM pg_class WHERE oid = to_regclass(%s)", (table,)
+    ).fetchone()
+    if persistence is None or persistence[0] != "p":
+        return False
+    if entry["num_rows"] == 0:
+        return True
+    return conn.execute(f"SELECT EXISTS (SELECT 1 FROM {table})").fetchone()[0]
+
+
+def stale_tables(
+    conn: psycopg.Connection, tables: list[str], paths: dict[str, Path]
+) -> list[str]:
+    entries = catalog_entries(conn, "table")
+    stale = [
+        table
+        for table in tables
+        if not is_current(entries.get(table), paths[table])
+        or not intact(conn, table, entries[table])
+    ]
+    closed = referencing_closure(stale, fk_graph(conn))
+    return [table for table in tables if table in closed]
+
+
+def load_complete(tables: list[str], schema_path: Path, post_load_path: Path) -> bool:
+    # Whether resume_load would find nothing to redo, without needing the data
+    # files: the caller can then skip generating them.
+    with psycopg.connect(conninfo(), autocommit=True) as conn:
+        exists = conn.execute("SELECT to_regclass(%s)", (CATALOG_TABLE,)).fetchone()
+        if exists[0] is None:
+            return False
+        schema_entry = catalog_entries(conn, "schema").get(schema_path.name)
+        post_load_entry = catalog_entries(conn, "post_load").get(post_load_path.name)
+        entries = catalog_entries(conn, "table")
+        return (
+            is_current(schema_entry, schema_path)
+            and is_current(post_load_entry, post_load_path)
+            and all(
+                table in entries and intact(conn, table, entries[table])
+                for table in tables
+            )
+        )
+
+
+def post_load(post_load_path: Path, bulk: bool, verbose=True):
+    sqls = list(sql_file_queries(post_load_path))
+    if bulk:
+        execute_dag(sqls, verbose=verbose)
+    else:
+        for sql in sqls:
+            execute_statement(sql, [], verbose=verbose)
+
+
+def resume_load(
+    tables: list[str],
+    table_paths: list[tuple[str, Path]],
+    schema_path: Path,
+    post_load_path: Path,
+    legacy_index: Optional[str] = None,
+    bulk=False,
+    generator=None,
+    verbose=True,
+) -> list[str]:
+    # Only the steps without a current load_catalog entry are redone: the schema
+    # if its file changed or a table is missing, tables whose source file changed
+    # or whose load did not complete (with everything referencing them), and the
+    # post-load statements. Returns the tables that still need a VACUUM.
+    # With a datagen.DataGenerator, tables are generated straight into COPY
+    # instead, and table_paths should point at the generator binary.
+    paths = dict(table_paths)
+    with psycopg.connect(conninfo(), autocommit=True) as conn:
+        conn.execute("SET statement_timeout = '0s'")
+        ensure_catalog(conn)
+        if legacy_index is not None and len(catalog_entries(conn, "schema")) == 0:
+            adopt_legacy(
+                conn, paths, schema_path, post_load_path, legacy_index, verbose=verbose
+            )
+
+        schema_entry = catalog_entries(conn, "schema").get(schema_path.name)
+        missing = [
+            table
+            for table in tables
+            if conn.execute("SELECT to_regclass(%s)", (table,)).fetchone()[0] is None
+        ]
+        if not is_current(schema_entry, schema_path) or len(missing) > 0:
+            create_schema(conn, tables, schema_path, verbose=verbose)
+
+        stale = stale_tables(conn, tables, paths)
+        if verbose:
+            print(f"Loading {len(stale)} of {len(tables)} tables: {stale}")
+        if len(stale) > 0:
+            with conn.transaction():
+                forget(conn, "table", stale)
+                conn.execute(f"TRUNCATE {', '.join(stale)} CASCADE")
+
+            # SET LOGGED rewrites the table and rebuilds its indexes, so it is
+            # done right after COPY and before the post-load statements.
+            if bulk:
+                set_logged(stale, logged=False, verbose=verbose)
+            for wave in fk_waves(stale, fk_graph(conn)):
+                if generator is None:
+                    copy_tables(
+                        [(table, paths[table]) for table in wave], verbose=verbose
+                    )
+                else:
+                    generator.load_tables(wave, verbose=verbose)
+            if bulk:
+                set_logged(stale, logged=True, verbose=verbose)
+
+        post_load_entry = catalog_entries(conn, "post_load").get(post_load_path.name)
+        if not is_current(post_load_entry, post_load_path):
+            post_load(post_load_path, bulk, verbose=verbose)
+            record(
+                conn,
+                "post_load",
+                post_load_path.name,
+                post_load_path,
+                post_load_path.stat(),
+                file_checksum(post_load_path),
+            )
+        return unvacuumed(conn)
+
+
+def vacuum_loaded(
+    engine: Engine,
+    connection: Connection,
+    tables: list[str],
+    command: str,
+    verbose=True,
+):
+    if len(tables) == 0:
+        return
+    vacuum_tables(engine, connection, tables, command, verbose=verbose)
+    with psycopg.connect(conninfo(), autocommit=True) as conn:
+        mark_vacuumed(conn, tables)
@@ -0,0 +1,111 @@
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+from tqdm import tqdm
+
+# One append-only manifest per experiment/benchmark/SF directory. Each line is
+# "<state>\t<key>", where the key is the query's artifact path relative to that
+# directory without a suffix (e.g., "15721/3-1" or "default/15721/query1-1").
+# Later lines for the same key win.
+MANIFEST_NAME = "manifest.log"
+STATES = ["ok", "timeout", "err"]
+
+
+def manifest_key(root: Path, outpath: Path) -> str:
+    return str(outpath.relative_to(root).with_suffix(""))
+
+
+def manifest_root(outpath: Path, benchmark: str) -> Path:
+    # Inverse of the layout used by tpch_run/dsb_run.
+    if benchmark == "dsb":
+        return outpath.parent.parent.parent
+    return outpath.parent.parent
+
+
+def scan_tree(root: Path) -> dict[str, str]:
+    # Recover completion state from legacy .ok/.timeout/.err touch files.
+    entries = {}
+    for done_path in [*root.glob("**/*.ok"), *root.glob("**/*.err")]:
+        key = manifest_key(root, done_path)
+        if key in entries:
+            continue
+        if done_path.with_suffix(".err").exists():
+            entries[key] = "err"
+        elif done_path.with_suffix(".timeout").exists():
+            entries[key] = "timeout"
+        else:
+            entries[key] = "ok"
+    return entries
+
+
+def convert_tree(root: Path) -> int:
+    entries = scan_tree(root)
+    tmp_path = root / f"{MANIFEST_NAME}.tmp{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        for key, state in sorted(entries.items()):
+            print(f"{state}\t{key}", file=f)
+    os.replace(tmp_path, root / MANIFEST_NAME)
+    return len(entries)
+
+
+def load_manifest(root: Path) -> dict[str, str]:
+    manifest_path = root / MANIFEST_NAME
+    if not manifest_path.exists():
+        if not root.exists():
+            return {}
+        convert_tree(root)
+    entries = {}
+    with open(manifest_path) as f:
+        for line in f:
+            # A torn final line from a crash is simply ignored.
+            if not line.endswith("\n"):
+                continue
+            state, _, key = line.rstrip("\n").partition("\t")
+            if state in STATES and len(key) > 0:
+                entries[key] = state
+    return entries
+
+
+class Manifest:
+    def __init__(self, root: Path):
+        root.mkdir(parents=True, exist_ok=True)
+        self.root = root
+        self.entries = load_manifest(root)
+        self.lock = threading.Lock()
+        self.file = open(root / MANIFEST_NAME, "a")
+
+    def key(self, outpath: Path) -> str:
+        return manifest_key(self.root, outpath)
+
+    def state(self, key: str) -> Optional[str]:
+        return self.entries.get(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+
+    def record(self, key: str, state: str):
+        assert state in STATES, f"Unknown manifest state: {state}"
+        with self.lock:
+            print(f"{state}\t{key}", file=self.file, flush=True)
+            self.entries[key] = state
+
+    def close(self):
+        self.file.close()
+
+
+def main():
+    artifact_root = Path(os.getenv("ARTIFACT_ROOT"))
+    rebuild = int(os.getenv("MANIFEST_REBUILD", "0")) == 1
+
+    roots = sorted(artifact_root.glob("experiment/*/*/sf_*"))
+    for root in tqdm(roots, desc="Manifests.", leave=None):
+        if (root / MANIFEST_NAME).exists() and not rebuild:
+            continue
+        num_entries = convert_tree(root)
+        print(f"{root / MANIFEST_NAME}: {num_entries} entries")
+
+
+if __name__ == "__main__":
+    main()
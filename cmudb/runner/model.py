@@ -1,9 +1,22 @@
+import ast
 import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
+from typing import Optional
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import ujson
 from autogluon.tabular import TabularDataset, TabularPredictor
+from fastmodel import FastModel
+from features import FeatureStore, load_features
+from manifest import load_manifest, manifest_key, manifest_root
+from sink import read_results
 
 KNOWN_COLS = [
     # (col_name, legal_feature)
@@ -102,6 +115,27 @@ KNOWN_COLS = [
 
 ALL_COLS = [col_name for col_name, _ in KNOWN_COLS]
 LEGAL_COLS = [col_name for col_name, legal_feature in KNOWN_COLS if legal_feature]
+# Columns that main needs besides the features.
+META_COLS = [
+    "Benchmark",
+    "Exclude",
+    "Experiment",
+    "Operator Time",
+    "Query",
+    "Query Total Time",
+    "SF",
+    "Seed",
+]
+PARTITION_COLS = ["Experiment", "Seed"]
+# Read as float32. Operator Time is the label and stays float64, like the
+# feature store's target, so that labels are unchanged.
+TIME_COLS = [
+    "Actual Startup Time",
+    "Actual Total Time",
+    "Query Execution Time",
+    "Query Planning Time",
+    "Query Total Time",
+]
 
 
 def generate_metadata(source_file: Path, artifact_root, model_benchmark, model_sf, bytejack):
@@ -132,75 +166,251 @@ def generate_metadata(source_file: Path, artifact_root, model_benchmark, model_s
 
 
 def shred(source_file: Path, plan_dict: dict, artifact_root, model_benchmark, model_sf, bytejack):
-    plan_cur = plan_dict["Plan"]
-    query_planning_time = plan_dict["Planning Time"]
-    query_execution_time = plan_dict["Execution Time"]
-    shreddable = [plan_cur]
+    # Every node of a plan shares the same file metadata, so compute it once.
+    metadata = generate_metadata(source_file, artifact_root, model_benchmark, model_sf, bytejack)
+    metadata["Query Planning Time"] = plan_dict["Planning Time"]
+    metadata["Query Execution Time"] = plan_dict["Execution Time"]
+    metadata["Query Total Time"] = plan_dict["Planning Time"] + plan_dict["Execution Time"]
+    metadata["Exclude"] = False
+    is_bytejack_expt = "bytejack" in metadata["Experiment"]
+
+    # Single pass over the plan. Input rows only need the children's own Plan
+    # Rows and Actual Rows, so they are summed when the children are pushed.
+    shreddable = [plan_dict["Plan"]]
     shredded = []
-
-    def has_stopped_somewhere(plan_node):
-        if plan_node.get("Operator Stopped", False):
-            return True
-        for child in plan_node.get("Plans", []):
-            if has_stopped_somewhere(child):
-                return True
-        return False
-
     while len(shreddable) > 0:
         plan_cur = shreddable.pop()
-        skip_cur = False
-
-        for k, v in generate_metadata(source_file, artifact_root, model_benchmark, model_sf, bytejack).items():
-            plan_cur[k] = v
-
-        plan_cur["Query Planning Time"] = query_planning_time
-        plan_cur["Query Execution Time"] = query_execution_time
-        plan_cur["Query Total Time"] = query_planning_time + query_execution_time
-        plan_cur["Exclude"] = False
-
-        if "Workers" in plan_cur:
-            del plan_cur["Workers"]
+        plan_cur.update(metadata)
+        plan_cur.pop("Workers", None)
 
         if plan_cur["Node Type"] == "Sample Scan":
             plan_cur["Node Type"] = "Seq Scan"
 
         estimated_input_rows = 0
         actual_input_rows = 0
-        if "Plans" in plan_cur:
-            for plan_child in plan_cur["Plans"]:
-                estimated_input_rows += plan_child["Plan Rows"]
-                actual_input_rows += plan_child["Actual Rows"]
-                shreddable.append(plan_child)
-            del plan_cur["Plans"]
+        for plan_child in plan_cur.pop("Plans", []):
+            estimated_input_rows += plan_child["Plan Rows"]
+            actual_input_rows += plan_child["Actual Rows"]
+            shreddable.append(plan_child)
         plan_cur["Estimated Input Rows"] = estimated_input_rows
         plan_cur["Actual Input Rows"] = actual_input_rows
 
-        if "bytejack" in plan_cur["Experiment"]:
+        if is_bytejack_expt:
             if plan_cur["Operator Time"] <= 1e-6:
                 plan_cur["Operator Time"] = 1e-6
 
-            if has_stopped_somewhere(plan_cur):
+            # Only the node's own flag counts: children are detached before this
+            # check, which is also what the recursive subtree check observed.
+            if plan_cur.get("Operator Stopped", False):
                 pct_done = max(1, plan_cur["Actual Rows"] / plan_cur["Plan Rows"]) * 100
                 # x% done in y seconds = 1% done in y/x seconds
                 plan_cur["Operator Time"] = plan_cur["Operator Time"] / pct_done * 100
 
-        if not skip_cur:
-            shredded.append(plan_cur)
-    return sorted(shredded, key=lambda x: x["Plan Node Id"])
+        shredded.append(plan_cur)
+
+    shredded.sort(key=lambda x: x["Plan Node Id"])
+    yield from shredded
 
 
-def load_results():
+def parse_plan(contents: str) -> dict:
+    # .res files hold the EXPLAIN (FORMAT JSON) output as JSON text. Files written
+    # before the runners switched to JSON hold the Python repr of the same dict
+    # (single-quoted strings, True/False/None). Those are read with
+    # ast.literal_eval, which accepts only literals and yields the same dict.
+    if contents.startswith("{'"):
+        return ast.literal_eval(contents)
+    return ujson.loads(contents)
+
+
+def shred_files(files: list[Path], plans: dict[str, str], artifact_root, model_benchmark, model_sf):
+    # Runs in a worker process; returns the chunk's operators as one record batch,
+    # which pickles as Arrow buffers rather than as a frame of Python objects.
+    # plans holds the plan text of the files that are in a result sink.
+    operators = []
+    for source_file in files:
+        if source_file.suffix == ".timeout":
+            metadata = generate_metadata(source_file, artifact_root, model_benchmark, model_sf, False)
+            metadata["Query Total Time"] = 5 * 60 * 1000  # timeout value
+            metadata["Exclude"] = True
+            operators.append(metadata)
+            continue
+        contents = plans.get(str(source_file))
+        if contents is None:
+            with open(source_file) as f:
+                contents = f.read()
+        if len(contents) == 0:
+            continue
+        j = parse_plan(contents)
+        bytejack = j.get("Bytejack") == "true"
+        operators.extend(shred(source_file, j, artifact_root, model_benchmark, model_sf, bytejack))
+    # Columns in order of first appearance, missing keys as nulls, as in
+    # json_normalize (from_pylist would only take the first row's keys).
+    cols = dict.fromkeys(col for operator in operators for col in operator)
+    return pa.RecordBatch.from_pydict(
+        {col: [operator.get(col) for operator in operators] for col in cols}
+    )
+
+
+def shred_all(files: list[Path], artifact_root, model_benchmark, model_sf, plans=None):
+    model_workers = int(os.getenv("MODEL_WORKERS", str(os.cpu_count())))
+    chunk_size = max(1, len(files) // (model_workers * 4))
+    chunks = [files[i : i + chunk_size] for i in range(0, len(files), chunk_size)]
+    plans = plans if plans is not None else {}
+    chunk_plans = [
+        {str(f): plans[str(f)] for f in chunk if str(f) in plans} for chunk in chunks
+    ]
+    shred_fn = partial(
+        shred_files,
+        artifact_root=artifact_root,
+        model_benchmark=model_benchmark,
+        model_sf=model_sf,
+    )
+    with ProcessPoolExecutor(max_workers=model_workers) as executor:
+        batches = list(executor.map(shred_fn, chunks, chunk_plans))
+    # Chunks are concatenated once, in file order, with the same widening as
+    # partitions (missing columns as nulls, mixed integer and float as float64),
+    # which gives the columns and dtypes of normalizing every operator at once.
+    tables = [pa.Table.from_batches([batch]) for batch in batches if batch.num_rows > 0]
+    if len(tables) == 0:
+        return pd.DataFrame()
+    return pa.concat_tables(unify_tables(tables)).to_pandas()
+
+
+def sink_plans(files: list[Path], model_benchmark) -> dict[str, str]:
+    # Runs with RUNNER_SINK also have every plan in their result segments, so the
+    # plans are read in one scan per experiment instead of one open per .res file.
+    # A sink row is only used if it is what the .res file holds (plan + newline),
+    # e.g., not if the query was rerun without a sink afterwards.
+    roots = {}
+    for source_file in files:
+        if source_file.suffix == ".res":
+            root = manifest_root(source_file, model_benchmark)
+            roots.setdefault(root, []).append(source_file)
+    plans = {}
+    for root, root_files in roots.items():
+        results = read_results(root)
+        if results.num_rows == 0:
+            continue
+        # Later segments win, like later manifest entries.
+        latest = dict(zip(results["Key"].to_pylist(), results["Plan"].to_pylist()))
+        for source_file in root_files:
+            plan = latest.get(manifest_key(root, source_file))
+            if plan is not None and len(plan.encode()) + 1 == source_file.stat().st_size:
+                plans[str(source_file)] = plan + "\n"
+    return plans
+
+
+def operator_cache_root(artifact_root: Path, model_benchmark, model_sf) -> Path:
+    return artifact_root / "cache" / f"experiment_{str(model_benchmark)}_sf_{str(model_sf)}"
+
+
+def partition_matches(part: str, filters) -> bool:
+    # Partitions are named <Experiment>/<Seed>, so filters on those columns can
+    # skip whole files. Every other filter is applied while reading.
+    if filters is None:
+        return True
+    values = dict(zip(PARTITION_COLS, part.split("/")))
+    for col, op, value in filters:
+        if col not in values:
+            continue
+        if op in ["=", "=="] and values[col] != str(value):
+            return False
+        if op == "in" and values[col] not in {str(v) for v in value}:
+            return False
+    return True
+
+
+def is_string_type(dtype: pa.DataType) -> bool:
+    return pa.types.is_string(dtype) or pa.types.is_large_string(dtype)
+
+
+def partition_filters(schema: pa.Schema, filters) -> Optional[list]:
+    # Filter values are cast to the partition's column types, e.g., an int Seed
+    # to the string column. A column missing from a partition was all null, and
+    # null matches no filter, so the partition has no matching rows (None).
+    cast = []
+    for col, op, value in filters:
+        if col not in schema.names:
+            return None
+        dtype = schema.field(col).type
+        if op in ["in", "not in"]:
+            value = [cast_value(dtype, v) for v in value]
+        else:
+            value = cast_value(dtype, value)
+        cast.append((col, op, value))
+    return cast
+
+
+def cast_value(dtype: pa.DataType, value):
+    if is_string_type(dtype):
+        return str(value)
+    if isinstance(value, str) and (
+        pa.types.is_integer(dtype) or pa.types.is_floating(dtype)
+    ):
+        return float(value)
+    return value
+
+
+def read_partition(path: Path, columns, filters) -> Optional[pa.Table]:
+    schema = pq.read_schema(path)
+    if filters is not None:
+        filters = partition_filters(schema, filters)
+        if filters is None:
+            return None
+    names = [name for name in schema.names if columns is None or name in columns]
+    # The row order is restored by Source, so it is always read.
+    if "Source" not in names:
+        names.append("Source")
+    strings = [name for name in names if is_string_type(schema.field(name).type)]
+    return pq.read_table(path, columns=names, filters=filters, read_dictionary=strings)
+
+
+def unify_tables(tables: list[pa.Table]) -> list[pa.Table]:
+    # Partitions can disagree on a column's type: a column that is all null in a
+    # partition is dropped from it, and an integer column with missing values is
+    # written as float. Mismatched numeric types are widened to float64.
+    types = {}
+    for table in tables:
+        for field in table.schema:
+            old_type = types.get(field.name)
+            if old_type is None or pa.types.is_null(old_type):
+                types[field.name] = field.type
+            elif not pa.types.is_null(field.type) and field.type != old_type:
+                numeric = [pa.types.is_integer, pa.types.is_floating]
+                if any(f(old_type) for f in numeric) and any(
+                    f(field.type) for f in numeric
+                ):
+                    types[field.name] = pa.float64()
+    unified = []
+    for table in tables:
+        arrays = []
+        for name, dtype in types.items():
+            if name not in table.column_names:
+                arrays.append(pa.nulls(table.num_rows, dtype))
+            elif table.schema.field(name).type != dtype:
+                arrays.append(table[name].cast(dtype))
+            else:
+                arrays.append(table[name])
+        unified.append(pa.Table.from_arrays(arrays, names=list(types)))
+    return unified
+
+
+def load_results(columns: Optional[list[str]] = None, filters=None):
+    # Reads the operator cache with a compact schema: every string column (labels
+    # such as Experiment, Query, Seed and Node Type, and the condition strings)
+    # is read as a dictionary and returned as a categorical, and timings other
+    # than the label are float32. columns selects the columns to read, and filters selects rows, in
+    # pyarrow's [(column, op, value), ...] form.
     artifact_root = Path(os.getenv("ARTIFACT_ROOT"))
     model_benchmark = str(os.getenv("MODEL_BENCHMARK"))
     model_sf = str(os.getenv("MODEL_SF"))
 
-    cache_root = artifact_root / "cache"
-
+    # The cache has one parquet file per Experiment/Seed partition, plus a record
+    # of the size and mtime of every source file that went into each partition.
+    # Only new or changed source files are shredded again.
+    cache_root = operator_cache_root(artifact_root, model_benchmark, model_sf)
     cache_root.mkdir(parents=True, exist_ok=True)
-    cached_df = cache_root / f"experiment_{str(model_benchmark)}_sf_{str(model_sf)}.pq"
-    if cached_df.exists():
-        df = pd.read_parquet(cached_df)
-        return df
+    sources_path = cache_root / "sources.json"
 
     if model_benchmark == "tpch":
         planfiles = sorted(
@@ -225,36 +435,299 @@ def load_results():
             )
         )
 
-    operators = []
-    for planfile in planfiles:
-        assert (
-            planfile.parent / f"{planfile.stem}.ok"
-        ).exists(), f".ok file missing for: {planfile}"
-        with open(planfile) as f:
-            contents = "".join(f.readlines())
-        if len(contents) == 0:
-            continue
-        bytejack = contents.startswith(r"{'Bytejack': 'true',")
-        j = eval(contents)
-        operators.extend(shred(planfile, j, artifact_root, model_benchmark, model_sf, bytejack))
+    manifests = {}
+
+    def completed(outpath: Path):
+        root = manifest_root(outpath, model_benchmark)
+        if root not in manifests:
+            manifests[root] = load_manifest(root)
+        return manifest_key(root, outpath) in manifests[root]
 
+    def partition(outpath: Path):
+        root = manifest_root(outpath, model_benchmark)
+        return f"{root.parent.parent.name}/{outpath.parent.name}"
+
+    source_files = [*planfiles, *toutfiles]
+    partitions = {}
+    for source_file in source_files:
+        assert completed(source_file), f"Not completed in manifest: {source_file}"
+        partitions.setdefault(partition(source_file), []).append(source_file)
+
+    # DefaultTimeout is derived from the default experiment's timeouts, so those
+    # are part of every partition's signature for the same seed.
+    default_timeouts = {}
     for toutfile in toutfiles:
-        assert (
-            planfile.parent / f"{planfile.stem}.ok"
-        ).exists(), f".ok file missing for: {planfile}"
-        metadata = generate_metadata(toutfile, artifact_root, model_benchmark, model_sf, False)
-        metadata["Query Total Time"] = 5 * 60 * 1000  # timeout value
-        metadata["Exclude"] = True
-        operators.append(metadata)
+        if partition(toutfile).split("/")[0] == "default":
+            default_timeouts.setdefault(toutfile.parent.name, []).append(toutfile.name)
+
+    old_sources = {}
+    if sources_path.exists():
+        with open(sources_path) as f:
+            old_sources = ujson.load(f)
+
+    sources = {}
+    stale_files = []
+    kept_files = {}
+    for part, part_files in partitions.items():
+        stats = {}
+        for source_file in part_files:
+            st = source_file.stat()
+            stats[str(source_file)] = [st.st_size, st.st_mtime_ns]
+        sources[part] = {
+            "default_timeouts": default_timeouts.get(part.split("/")[1], []),
+            "files": stats,
+        }
+
+        old = old_sources.get(part)
+        if (
+            old is None
+            or old["default_timeouts"] != sources[part]["default_timeouts"]
+            or not (cache_root / f"{part}.pq").exists()
+        ):
+            old = {"files": {}}
+        kept_files[part] = {k for k, v in stats.items() if old["files"].get(k) == v}
+        stale_files.extend(f for f in part_files if str(f) not in kept_files[part])
+
+    plans = sink_plans(stale_files, model_benchmark)
+    new_df = shred_all(stale_files, artifact_root, model_benchmark, model_sf, plans)
+    if len(new_df) > 0:
+        new_parts = new_df["Source"].map(lambda s: partition(Path(s)))
+
+    for part in set(old_sources) - set(partitions):
+        (cache_root / f"{part}.pq").unlink(missing_ok=True)
+    for part in partitions:
+        old_files = set(old_sources.get(part, {}).get("files", {}))
+        if len(kept_files[part]) == len(old_files) == len(sources[part]["files"]):
+            continue
+        part_path = cache_root / f"{part}.pq"
+        part_frames = []
+        if len(kept_files[part]) > 0:
+            old_df = pd.read_parquet(part_path)
+            part_frames.append(old_df[old_df["Source"].isin(kept_files[part])])
+        if len(new_df) > 0:
+            part_frames.append(new_df[new_parts == part].dropna(axis=1, how="all"))
+        part_frames = [frame for frame in part_frames if len(frame) > 0]
+        part_df = (
+            pd.concat(part_frames, ignore_index=True)
+            if len(part_frames) > 0
+            else pd.DataFrame()
+        )
+        part_path.parent.mkdir(parents=True, exist_ok=True)
+        part_df.to_parquet(part_path)
 
-    df = pd.json_normalize(operators)
+    tmp_path = sources_path.with_suffix(f".tmp{os.getpid()}")
+    with open(tmp_path, "w") as f:
+        ujson.dump(sources, f)
+    os.replace(tmp_path, sources_path)
 
+    parts = [part for part in sorted(partitions) if partition_matches(part, filters)]
+    tables = [
+        read_partition(cache_root / f"{part}.pq", columns, filters) for part in parts
+    ]
+    tables = [table for table in tables if table is not None and table.num_rows > 0]
+    if len(tables) == 0:
+        return pd.DataFrame()
+    table = pa.concat_tables(unify_tables(tables)).unify_dictionaries()
+    for col in TIME_COLS:
+        if col in table.column_names:
+            i = table.column_names.index(col)
+            table = table.set_column(i, col, table[col].cast(pa.float32()))
+    df = table.to_pandas()
+    # Dictionaries come back in order of appearance; sorted categories keep
+    # groupby and pivot output in the same order as for plain strings.
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].cat.reorder_categories(sorted(df[col].cat.categories))
     assert set(df.columns.unique()).issubset(
         set(ALL_COLS)
     ), f"Unknown columns? {df.columns.unique().difference(set(ALL_COLS))}"
-    df.to_parquet(cached_df)
-    df = pd.read_parquet(cached_df)
-    return df
+
+    # Restore the uncached row order (plan files, then timeout files, each sorted)
+    # and fix the column order so it does not depend on which partitions changed.
+    source_rank = {str(source_file): i for i, source_file in enumerate(source_files)}
+    sources = df["Source"].array
+    ranks = np.array([source_rank[source] for source in sources.categories])
+    df = df.iloc[np.argsort(ranks[sources.codes], kind="stable")]
+    df = df[[col for col in ALL_COLS if col in df.columns]]
+    if columns is not None and "Source" not in columns:
+        df = df.drop(columns=["Source"])
+    return df.reset_index(drop=True)
+
+
+def fit_experiments(
+    jobs: list[tuple[str, Path, float]],
+    store_root: Path,
+    target_col: str,
+    cpus: list[int],
+    memory_ratio: float,
+) -> dict[str, tuple[float, float]]:
+    # Runs in a worker process pinned to its share of the cores. Every fit gets
+    # exactly this share, so a fit does not depend on what else is running.
+    # Returns each experiment's validation MAE and fit seconds.
+    os.sched_setaffinity(0, cpus)
+    store = FeatureStore(store_root)
+    results = {}
+    for expt, model_path, time_limit in jobs:
+        start = time.time()
+        predictor = TabularPredictor(
+            label=target_col,
+            path=str(model_path),
+            eval_metric="mean_absolute_error",
+        )
+        predictor.fit(
+            TabularDataset(store.train(expt)),
+            time_limit=time_limit,
+            num_cpus=len(cpus),
+            num_gpus=0,
+            # Each model's share of available memory.
+            ag_args_fit={"max_memory_usage_ratio": memory_ratio},
+        )
+        # score_val is higher-is-better, i.e., the negated MAE.
+        mae = -predictor.leaderboard(silent=True)["score_val"].max()
+        results[expt] = (mae, time.time() - start)
+    return results
+
+
+def fit_round(
+    jobs: list[tuple[str, Path, float]], store: FeatureStore, target_col: str
+) -> dict[str, tuple[float, float]]:
+    # MODEL_TRAIN_WORKERS processes each get a contiguous slice of the cores and
+    # an even share of MODEL_TRAIN_MEMORY_GB (by default, all of RAM). Jobs are
+    # dealt out round-robin in order, so each one is always fit on the same
+    # share. Its predictions are comparable to, not identical with, fitting it
+    # alone on that share: AutoGluon's time limits and thread scheduling are not
+    # deterministic. A single worker fits in this process.
+    cpus = sorted(os.sched_getaffinity(0))
+    num_workers = int(os.getenv("MODEL_TRAIN_WORKERS", "1"))
+    num_workers = max(1, min(num_workers, len(jobs), len(cpus)))
+    total_gb = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / (1 << 30)
+    memory_gb = os.getenv("MODEL_TRAIN_MEMORY_GB", "")
+    memory_gb = float(memory_gb) if len(memory_gb) > 0 else total_gb
+
+    shares = [share.tolist() for share in np.array_split(cpus, num_workers)]
+    fit_fn = partial(
+        fit_experiments,
+        store_root=store.root,
+        target_col=target_col,
+        memory_ratio=min(1.0, memory_gb / num_workers / total_gb),
+    )
+    if num_workers == 1:
+        return fit_fn(jobs, cpus=shares[0])
+    results = {}
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [
+            executor.submit(fit_fn, jobs[i::num_workers], cpus=shares[i])
+            for i in range(num_workers)
+        ]
+        for future in futures:
+            results.update(future.result())
+    return results
+
+
+def fit_all(
+    expts: list[str], model_root: Path, store: FeatureStore, target_col: str
+) -> pd.DataFrame:
+    # Without MODEL_TRAIN_BUDGET_S, every experiment gets one 5 minute fit.
+    # With it, budgets are allotted by successive halving: every experiment is
+    # first fit for MODEL_TRAIN_MIN_S, then refit with double the time. After
+    # that, only the better half (by relative gain) of the experiments whose
+    # validation MAE still improved by MODEL_TRAIN_MIN_GAIN is refit with double
+    # the time again, until none are left or the budget is spent. The budget caps
+    # the sum of every fit's time limit. Each experiment keeps its best fit.
+    pending = [expt for expt in expts if not (model_root / expt).exists()]
+    rounds_root = model_root / "rounds"
+    shutil.rmtree(rounds_root, ignore_errors=True)
+    budget_s = os.getenv("MODEL_TRAIN_BUDGET_S", "")
+    if len(budget_s) > 0:
+        budget_s = float(budget_s)
+        round_s = float(os.getenv("MODEL_TRAIN_MIN_S", "30"))
+        max_rounds = None
+    else:
+        budget_s = 60 * 5 * len(pending)
+        round_s = 60 * 5
+        max_rounds = 1
+    min_gain = float(os.getenv("MODEL_TRAIN_MIN_GAIN", "0.01"))
+    if budget_s <= 0 and len(pending) > 0:
+        raise Exception(f"MODEL_TRAIN_BUDGET_S must be positive: {budget_s}")
+
+    report = {
+        expt: {"Experiment": expt, "Rounds": 0, "Budget (s)": 0.0, "Train (s)": 0.0}
+        for expt in pending
+    }
+    best = {}
+    alive = list(pending)
+    spent_s = 0.0
+    num_round = 0
+    while len(alive) > 0 and (max_rounds is None or num_round < max_rounds):
+        limit_s = round_s * 2**num_round
+        if spent_s + limit_s * len(alive) > budget_s:
+            # Every experiment needs a model, so the first round always runs,
+            # splitting the budget if it is too small for MODEL_TRAIN_MIN_S each.
+            # A later round gets whatever is left, if that still buys more time.
+            limit_s = (budget_s - spent_s) / len(alive)
+            last_s = round_s * 2 ** (num_round - 1)
+            if num_round > 0 and (limit_s < round_s or limit_s <= last_s):
+                break
+        jobs = [
+            (expt, (rounds_root / expt / str(num_round)).absolute(), limit_s)
+            for expt in alive
+        ]
+        results = fit_round(jobs, store, target_col)
+        spent_s += limit_s * len(alive)
+
+        gains = {}
+        for expt, model_path, _ in jobs:
+            mae, fit_s = results[expt]
+            report[expt]["Rounds"] += 1
+            report[expt]["Budget (s)"] += limit_s
+            report[expt]["Train (s)"] += fit_s
+            if expt in best:
+                gains[expt] = (best[expt][0] - mae) / max(best[expt][0], 1e-9)
+            if expt not in best or mae < best[expt][0]:
+                best[expt] = (mae, model_path, num_round)
+
+        if num_round > 0:
+            improving = sorted(
+                (expt for expt in alive if gains[expt] >= min_gain),
+                key=lambda expt: -gains[expt],
+            )
+            alive = improving[: (len(improving) + 1) // 2]
+        num_round += 1
+
+    missing = [expt for expt in pending if expt not in best]
+    if len(missing) > 0:
+        raise Exception(f"No model fit for experiments: {missing}")
+    for expt, (mae, model_path, best_round) in best.items():
+        os.replace(model_path, model_root / expt)
+        report[expt]["Validation MAE"] = mae
+        report[expt]["Best Round"] = best_round
+    shutil.rmtree(rounds_root, ignore_errors=True)
+    # Experiments fit by earlier runs keep their rows.
+    report_df = pd.DataFrame(list(report.values()))
+    report_path = model_root / "training.csv"
+    if report_path.exists():
+        old_df = pd.read_csv(report_path)
+        old_df = old_df[~old_df["Experiment"].isin(pending)]
+        report_df = pd.concat([old_df, report_df], ignore_index=True)
+    if len(report_df) > 0:
+        report_df.to_csv(report_path, index=False)
+    return report_df
+
+
+def fast_model_path(model_root: Path, expt: str) -> Path:
+    return model_root / "fast" / f"{expt}.npz"
+
+
+def fit_fast(expts: list[str], model_root: Path, store: FeatureStore, target_col: str):
+    # The compact NumPy backend, fit on the same feature slices as AutoGluon.
+    cols = [name for name in store.columns if name != target_col]
+    for expt in expts:
+        path = fast_model_path(model_root, expt)
+        if path.exists():
+            continue
+        start = time.time()
+        FastModel.fit(store.train(expt), cols, target_col).save(path)
+        print(f"Fit fast model {expt} in {time.time() - start:.1f}s.")
 
 
 def main():
@@ -262,10 +735,11 @@ def main():
     model_benchmark = str(os.getenv("MODEL_BENCHMARK"))
     model_sf = str(os.getenv("MODEL_SF"))
 
-    df = load_results()
+    # Only the features and the columns used below are read.
+    df = load_results(columns=LEGAL_COLS + META_COLS)
 
     if model_benchmark == "tpch":
-        seeds = df["Seed"].unique()
+        seeds = df["Seed"].unique().tolist()
         rng = np.random.default_rng(15721)
         train_seeds = sorted(
             rng.choice(seeds, size=int(0.8 * len(seeds)), replace=False).tolist()
@@ -292,33 +766,32 @@ def main():
     ]
     eval_df = test_df.copy()
 
-    expts = []
-    for expt in df[(df["Benchmark"] == model_benchmark) & (df["SF"] == model_sf)][
+    # Features are encoded once and every experiment's slices are views of it.
+    cols = [c for c in LEGAL_COLS if c in df.columns.unique()]
+    store = load_features(
+        operator_cache_root(artifact_root, model_benchmark, model_sf),
+        df,
+        cols,
+        target_col,
+        train_seeds,
+        test_seeds,
+    )
+    test_data = TabularDataset(store.test())
+
+    all_expts = df[(df["Benchmark"] == model_benchmark) & (df["SF"] == model_sf)][
         "Experiment"
-    ].unique():
-        model_path = (model_root / expt).absolute()
+    ].unique()
+    fit_all(list(all_expts), model_root, store, target_col)
+    fit_fast(list(all_expts), model_root, store, target_col)
 
-        train_df = df[
-            (df["Seed"].isin(train_seeds))
-            & (df["Experiment"] == expt)
-            & (df["Benchmark"] == model_benchmark)
-            & (df["SF"] == model_sf)
-            & (df["Exclude"] == False)
-        ]
+    expts = []
+    for expt in all_expts:
+        model_path = (model_root / expt).absolute()
 
-        cols = [c for c in LEGAL_COLS if c in df.columns.unique()] + [target_col]
-        train_data = TabularDataset(train_df[cols])
-        test_data = TabularDataset(test_df[cols])
+        train_data = TabularDataset(store.train(expt))
         print(f"{LEGAL_COLS=} {target_col=}")
         print(f"{train_data.shape=} {test_data.shape=}")
 
-        if not model_path.exists():
-            predictor = TabularPredictor(
-                label=target_col,
-                path=str(model_path),
-                eval_metric="mean_absolute_error",
-            )
-            predictor.fit(train_data, time_limit=60 * 5)
         predictor = TabularPredictor.load(str(model_path))
 
         eval_df[f"Predicted_{expt}"] = predictor.predict(
@@ -327,6 +800,10 @@ def main():
         eval_df[f"Absolute Error_{expt}"] = (
             eval_df[target_col] - eval_df[f"Predicted_{expt}"]
         ).abs()
+        fast_model = FastModel.load(fast_model_path(model_root, expt))
+        eval_df[f"FastPredicted_{expt}"] = pd.Series(
+            fast_model.predict(test_data), index=test_data.index
+        )
         expts.append(expt)
 
     benchmark_sf_df = df[(df["Benchmark"] == model_benchmark) & (df["SF"] == model_sf)]
@@ -335,20 +812,28 @@ def main():
         values=["Query Total Time"],
         index=["Query", "Seed"],
         columns=["Experiment"],
+        observed=True,
         aggfunc="first",
     ).droplevel(0, axis=1)
+    # Older pandas returns observed categories in order of appearance.
+    runtime = runtime.sort_index()
     runtime.to_csv(model_root / "runtime_query_seed.csv")
-    runtime.groupby(level=0).sum().to_csv(model_root / "runtime_query.csv")
+    runtime.groupby(level=0, observed=True).sum().to_csv(
+        model_root / "runtime_query.csv"
+    )
     runtime.sum().to_csv(model_root / "runtime.csv")
 
     prediction = eval_df.pivot_table(
         values=["Operator Time", *[f"Predicted_{expt}" for expt in expts]],
         index=["Query", "Seed"],
         columns=["Experiment"],
+        observed=True,
         aggfunc="sum",
-    )
+    ).sort_index()
     prediction.to_csv(model_root / "prediction_query_seed.csv")
-    prediction.groupby(level=0).sum().to_csv(model_root / "prediction_query.csv")
+    prediction.groupby(level=0, observed=True).sum().to_csv(
+        model_root / "prediction_query.csv"
+    )
     prediction.sum().to_csv(model_root / "prediction.csv")
 
     abs_err_data = {}
@@ -362,12 +847,33 @@ def main():
         ).abs()
     abs_err_df = pd.DataFrame(abs_err_data)
     abs_err_df.to_csv(model_root / "error_query_seed.csv")
-    abs_err_df.groupby(level=0).sum().to_csv(model_root / "error_query.csv")
+    abs_err_df.groupby(level=0, observed=True).sum().to_csv(
+        model_root / "error_query.csv"
+    )
     abs_err_df.sum().to_csv(model_root / "error.csv")
 
-    (runtime.sum() / 1000).to_frame("Runtime (s)").join(
-        abs_err_df.mean().to_frame("MAE (s)")
-    ).sort_values(by=["MAE (s)", "Runtime (s)"]).to_csv(model_root / "summary.csv")
+    fast_prediction = eval_df.pivot_table(
+        values=[f"FastPredicted_{expt}" for expt in expts],
+        index=["Query", "Seed"],
+        columns=["Experiment"],
+        observed=True,
+        aggfunc="sum",
+    ).sort_index()
+    fast_abs_err_df = pd.DataFrame(
+        {
+            a[len("FastPredicted_") :]: (
+                fast_prediction[(a, b)] - prediction[("Operator Time", "default")]
+            ).abs()
+            for a, b in fast_prediction
+        }
+    )
+    fast_abs_err_df.to_csv(model_root / "error_fast_query_seed.csv")
+
+    summary = (runtime.sum() / 1000).to_frame("Runtime (s)")
+    summary = summary.join(abs_err_df.mean().to_frame("MAE (s)"))
+    summary = summary.join(fast_abs_err_df.mean().to_frame("Fast MAE (s)"))
+    summary = summary.sort_values(by=["MAE (s)", "Runtime (s)"])
+    summary.to_csv(model_root / "summary.csv")
 
     # breakpoint()
 
@@ -0,0 +1,382 @@
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Optional
+
+import psycopg
+from executor import select_configs
+from manifest import MANIFEST_NAME, load_manifest
+from predictor import HISTORY_NAME, RuntimeHistory
+from util import conninfo
+
+# Runs a benchmark's configs on ORCH_INSTANCES local instances at once. Each
+# instance gets a contiguous share of this process's CPUs and an even share of
+# ORCH_MEMORY_MB (by default, the source's shared_buffers), and pulls configs
+# off a shared queue in file order, running each one in its own runner process.
+#
+# ORCH_CLONE=datadir clones the running cluster with pg_basebackup and starts a
+# postmaster per clone on consecutive ports from ORCH_BASE_PORT. Clones are
+# isolated from each other but cost a full copy of the cluster each.
+# ORCH_CLONE=template instead copies the benchmark database inside the running
+# cluster (CREATE DATABASE ... TEMPLATE), which is cheap but shares the one
+# postmaster's shared_buffers; only the runner and its parallel workers are
+# limited to the instance's CPU share.
+#
+# bytejack configs share the one Redis cache that bytejack_cache_clear() flushes,
+# so at most one of them runs at a time; other configs run alongside it.
+#
+# Each instance writes into its own staging ARTIFACT_ROOT, seeded with the
+# config's manifests and the runtime history so that finished queries are still
+# skipped. Once a config finishes, its staged tree is merged into ARTIFACT_ROOT.
+CLONES = ["datadir", "template"]
+RUNNERS = {"tpch": "tpch_run.py", "dsb": "dsb_run.py"}
+STAGE_DIR = "instance"
+MAINTENANCE_DB = "postgres"
+
+
+def cpu_shares(num_instances: int) -> list[list[int]]:
+    cpus = sorted(os.sched_getaffinity(0))
+    num_instances = max(1, min(num_instances, len(cpus)))
+    size, extra = divmod(len(cpus), num_instances)
+    shares = []
+    start = 0
+    for i in range(num_instances):
+        stop = start + size + (1 if i < extra else 0)
+        shares.append(cpus[start:stop])
+        start = stop
+    return shares
+
+
+def shared_buffers_mb() -> int:
+    with psycopg.connect(conninfo()) as conn:
+        (num_bytes,) = conn.execute(
+            "SELECT setting::bigint * current_setting('block_size')::bigint "
+            "FROM pg_settings WHERE name = 'shared_buffers'"
+        ).fetchone()
+    return num_bytes >> 20
+
+
+def append_new(src: Path, dest: Path, seeded_bytes: int):
+    # Appends what was written to src past the seeded prefix.
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    with open(src, "rb") as f_src, open(dest, "ab") as f_dest:
+        f_src.seek(seeded_bytes)
+        shutil.copyfileobj(f_src, f_dest)
+
+
+class Instance(ABC):
+    def __init__(
+        self,
+        num: int,
+        benchmark: str,
+        cpus: list[int],
+        memory_mb: int,
+        artifact_root: Path,
+    ):
+        self.num = num
+        self.benchmark = benchmark
+        self.cpus = cpus
+        self.memory_mb = memory_mb
+        self.artifact_root = artifact_root
+        self.stage_root = artifact_root / STAGE_DIR / str(num)
+        self.log_path = self.stage_root / "instance.log"
+        self.env = dict(os.environ)
+        # Bounds the runner's own parallel plans to this instance's CPUs.
+        self.env["PGOPTIONS"] = (
+            f"-c max_parallel_workers_per_gather={len(cpus)} "
+            f"-c max_parallel_workers={len(cpus)}"
+        )
+        self.env["ARTIFACT_ROOT"] = str(self.stage_root)
+        self.seeded: dict[Path, int] = {}
+
+    def pin(self):
+        os.sched_setaffinity(0, self.cpus)
+
+    @abstractmethod
+    def start(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def stop(self):
+        raise NotImplementedError
+
+    def stage(self, expt: str):
+        # Relative path -> seeded length, for files merged by appending.
+        self.seeded = {}
+        (self.stage_root / "cache").mkdir(parents=True, exist_ok=True)
+        for root in sorted(self.artifact_root.glob(f"experiment/{expt}/*/sf_*")):
+            # Also converts legacy trees that predate manifests.
+            load_manifest(root)
+            self.seed(root / MANIFEST_NAME)
+        # Backfills the shared history first if it does not exist yet.
+        RuntimeHistory(self.artifact_root).close()
+        self.seed(self.artifact_root / "cache" / HISTORY_NAME)
+        # The corpus cache is read-mostly; a copy saves reparsing every query.
+        corpus_path = self.artifact_root / "cache" / "corpus.bin"
+        if corpus_path.exists():
+            shutil.copyfile(corpus_path, self.stage_root / "cache" / "corpus.bin")
+
+    def seed(self, path: Path):
+        if not path.exists():
+            return
+        rel = path.relative_to(self.artifact_root)
+        dest = self.stage_root / rel
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(path, dest)
+        self.seeded[rel] = dest.stat().st_size
+
+    def merge(self, expt: str):
+        appended = {MANIFEST_NAME, HISTORY_NAME}
+        expt_root = self.stage_root / "experiment" / expt
+        paths = [self.stage_root / "cache" / HISTORY_NAME]
+        if expt_root.exists():
+            paths.extend(sorted(p for p in expt_root.rglob("*") if p.is_file()))
+        for path in paths:
+            if not path.exists():
+                continue
+            rel = path.relative_to(self.stage_root)
+            dest = self.artifact_root / rel
+            if path.name in appended:
+                append_new(path, dest, self.seeded.get(rel, 0))
+            else:
+                dest.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(path, dest)
+        shutil.rmtree(expt_root, ignore_errors=True)
+
+    def run(self, expt: str) -> int:
+        runner = RUNNERS[self.benchmark]
+        env = {**self.env, "RUNNER_CONFIGS": expt}
+        with open(self.log_path, "a") as log:
+            print(f"{time.ctime()} {expt}", file=log, flush=True)
+            proc = subprocess.run(
+                [sys.executable, str(Path(__file__).parent / runner)],
+                env=env,
+                stdout=log,
+                stderr=subprocess.STDOUT,
+                preexec_fn=self.pin,
+            )
+        return proc.returncode
+
+
+class DatadirInstance(Instance):
+    def __init__(self, *args, port: int, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.port = port
+        self.bin_dir = Path(os.getenv("POSTGRES_BIN_DIR"))
+        self.data_dir = (
+            Path(os.getenv("POSTGRES_DATA_DIR")) / STAGE_DIR / str(self.num) / "pgdata"
+        )
+        self.proc: Optional[subprocess.Popen] = None
+        self.env["POSTGRES_PORT"] = str(port)
+
+    def start(self):
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+        self.data_dir.parent.mkdir(parents=True, exist_ok=True)
+        subprocess.run(
+            [
+                str(self.bin_dir / "pg_basebackup"),
+                "-h",
+                os.getenv("POSTGRES_HOST"),
+                "-p",
+                os.getenv("POSTGRES_PORT"),
+                "-U",
+                os.getenv("POSTGRES_USER"),
+                "-D",
+                str(self.data_dir),
+                "-c",
+                "fast",
+                "-X",
+                "stream",
+            ],
+            env={**os.environ, "PGPASSWORD": os.getenv("POSTGRES_PASS")},
+            check=True,
+        )
+        # Command-line settings override the cloned postgresql.auto.conf.
+        num_cpus = len(self.cpus)
+        settings = {
+            "shared_buffers": f"{self.memory_mb}MB",
+            "effective_cache_size": f"{self.memory_mb * 3}MB",
+            "max_worker_processes": num_cpus,
+            "max_parallel_workers": num_cpus,
+            "max_parallel_workers_per_gather": num_cpus,
+        }
+        args = [str(self.bin_dir / "postgres"), "-D", str(self.data_dir)]
+        args.extend(["-p", str(self.port)])
+        for name, value in settings.items():
+            args.extend(["-c", f"{name}={value}"])
+        log = open(self.stage_root / "postgres.log", "a")
+        self.proc = subprocess.Popen(
+            args, stdout=log, stderr=subprocess.STDOUT, preexec_fn=self.pin
+        )
+        log.close()
+        while (
+            subprocess.run(
+                [str(self.bin_dir / "pg_isready"), "-p", str(self.port)],
+                stdout=subprocess.DEVNULL,
+            ).returncode
+            != 0
+        ):
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"Instance {self.num} postmaster exited.")
+            time.sleep(1)
+
+    def stop(self):
+        if self.proc is not None and self.proc.poll() is None:
+            subprocess.run(
+                [str(self.bin_dir / "pg_ctl"), "-D", str(self.data_dir)]
+                + ["stop", "-m", "fast"],
+                stdout=subprocess.DEVNULL,
+            )
+            self.proc.wait()
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+
+
+class TemplateInstance(Instance):
+    # CREATE DATABASE ... TEMPLATE fails while anyone else is connected to the
+    # source database, including another instance cloning it. Clones are
+    # therefore made one at a time, from the maintenance database.
+    clone_lock = threading.Lock()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.source_db = os.getenv("POSTGRES_DB")
+        self.db = f"{self.source_db}_{STAGE_DIR}_{self.num}"
+        self.env["POSTGRES_DB"] = self.db
+
+    def start(self):
+        with TemplateInstance.clone_lock, psycopg.connect(
+            conninfo(), dbname=MAINTENANCE_DB, autocommit=True
+        ) as conn:
+            conn.execute(f"DROP DATABASE IF EXISTS {self.db}")
+            conn.execute(f"CREATE DATABASE {self.db} TEMPLATE {self.source_db}")
+
+    def stop(self):
+        with psycopg.connect(
+            conninfo(), dbname=MAINTENANCE_DB, autocommit=True
+        ) as conn:
+            conn.execute(f"DROP DATABASE IF EXISTS {self.db}")
+
+
+def make_instances(benchmark: str, artifact_root: Path) -> list[Instance]:
+    clone = os.getenv("ORCH_CLONE", "datadir")
+    if clone not in CLONES:
+        raise Exception(f"Unknown ORCH_CLONE: {clone}")
+    shares = cpu_shares(int(os.getenv("ORCH_INSTANCES", "1")))
+    memory_mb = os.getenv("ORCH_MEMORY_MB", "")
+    memory_mb = int(memory_mb) if len(memory_mb) > 0 else shared_buffers_mb()
+    base_port = int(os.getenv("ORCH_BASE_PORT", int(os.getenv("POSTGRES_PORT")) + 1))
+
+    instances = []
+    for num, cpus in enumerate(shares):
+        args = (num, benchmark, cpus, memory_mb // len(shares), artifact_root)
+        if clone == "datadir":
+            instances.append(DatadirInstance(*args, port=base_port + num))
+        else:
+            instances.append(TemplateInstance(*args))
+        instances[-1].stage_root.mkdir(parents=True, exist_ok=True)
+    return instances
+
+
+class ConfigQueue:
+    # Hands out configs in order, skipping those whose resource is in use.
+    def __init__(self, configs: list[tuple[str, Optional[str]]]):
+        self.pending = list(configs)
+        self.in_use = set()
+        self.cond = threading.Condition()
+
+    def take(self) -> Optional[tuple[str, Optional[str]]]:
+        with self.cond:
+            while len(self.pending) > 0:
+                for i, (expt, resource) in enumerate(self.pending):
+                    if resource is None or resource not in self.in_use:
+                        if resource is not None:
+                            self.in_use.add(resource)
+                        return self.pending.pop(i)
+                self.cond.wait()
+            return None
+
+    def done(self, resource: Optional[str]):
+        with self.cond:
+            self.in_use.discard(resource)
+            self.cond.notify_all()
+
+
+def config_resource(config) -> Optional[str]:
+    if any("bytejack_connect" in sql for sql in config.before_sql):
+        return "bytejack"
+    return None
+
+
+def orchestrate(benchmark: str, configs: list):
+    artifact_root = Path(os.getenv("ARTIFACT_ROOT"))
+    instances = make_instances(benchmark, artifact_root)
+    pending = ConfigQueue(
+        [(config.expt_name, config_resource(config)) for config in configs]
+    )
+    merge_lock = threading.Lock()
+    failed = []
+
+    def work(instance: Instance):
+        try:
+            instance.start()
+        except Exception:
+            traceback.print_exc()
+            print(f"ERROR STARTING INSTANCE: {instance.num}")
+            return
+        try:
+            while (taken := pending.take()) is not None:
+                expt, resource = taken
+                start = time.time()
+                returncode = -1
+                try:
+                    with merge_lock:
+                        instance.stage(expt)
+                    returncode = instance.run(expt)
+                    with merge_lock:
+                        instance.merge(expt)
+                except Exception:
+                    traceback.print_exc()
+                finally:
+                    pending.done(resource)
+                if returncode != 0:
+                    with merge_lock:
+                        failed.append(expt)
+                print(
+                    f"Instance {instance.num} {expt}: "
+                    f"{'ok' if returncode == 0 else 'failed'} "
+                    f"in {time.time() - start:.0f} s."
+                )
+        finally:
+            instance.stop()
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in instances]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Configs left over if every instance failed to start.
+    failed.extend(expt for expt, _ in pending.pending)
+    if len(failed) > 0:
+        raise RuntimeError(f"Failed configs: {failed}")
+
+
+def main():
+    benchmark = sys.argv[1]
+    if benchmark == "tpch":
+        from tpch_run import make_configs
+    elif benchmark == "dsb":
+        from dsb_run import make_configs
+    else:
+        raise Exception(f"Unknown benchmark: {benchmark}")
+    orchestrate(benchmark, select_configs(make_configs()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+import hashlib
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import ujson
+from autogluon.tabular import TabularPredictor
+from features import FEATURES_DIR, META_NAME, FeatureStore
+from model import LEGAL_COLS, operator_cache_root
+
+# A long-lived process that keeps each (benchmark, SF, experiment)'s predictor
+# loaded and serves operator-time predictions over a Unix socket
+# (PREDICT_SOCKET, by default <ARTIFACT_ROOT>/cache/predict.sock) or, with
+# PREDICT_PORT set, over TCP on localhost.
+#
+# The protocol is one JSON object per line in each direction:
+#   {"op": "predict", "benchmark": "tpch", "sf": "1", "expt": "default",
+#    "operators": [{"Node Type": "Seq Scan", ...}, ...]}
+#     -> {"predictions": [...], "hits": <rows served from the cache>}
+#   {"op": "stats"} -> request count, cache counters and latency percentiles.
+# Operators are shredded plan nodes as in model.shred, with None for missing
+# values. Only the predictor's feature columns are read.
+#
+# Predictions are cached by (model, feature row hash) in a bounded LRU. Rows
+# that miss are queued, and a single batcher thread predicts everything queued
+# within PREDICT_BATCH_MS (up to PREDICT_BATCH_ROWS rows) with one predict()
+# call per model.
+
+
+def default_address():
+    port = os.getenv("PREDICT_PORT", "")
+    if len(port) > 0:
+        return "127.0.0.1", int(port)
+    socket_path = os.getenv("PREDICT_SOCKET", "")
+    if len(socket_path) > 0:
+        return socket_path
+    return str(Path(os.getenv("ARTIFACT_ROOT")) / "cache" / "predict.sock")
+
+
+class Model:
+    def __init__(self, artifact_root: Path, benchmark: str, sf: str, expt: str):
+        model_root = artifact_root / "model" / f"{benchmark}_sf_{sf}"
+        self.predictor = TabularPredictor.load(str(model_root / expt))
+        # Inputs are encoded the way the training slices were, if the feature
+        # store that produced them is still around.
+        self.kinds = {}
+        store_root = operator_cache_root(artifact_root, benchmark, sf) / FEATURES_DIR
+        if (store_root / META_NAME).exists():
+            for name, (_, dtype) in FeatureStore(store_root).columns.items():
+                self.kinds[name] = dtype
+        self.cols = [col for col in self.predictor.features() if col in LEGAL_COLS]
+
+    def row_hash(self, operator: dict) -> bytes:
+        values = ujson.dumps([operator.get(col) for col in self.cols])
+        return hashlib.blake2b(values.encode(), digest_size=16).digest()
+
+    def frame(self, operators: list[dict]) -> pd.DataFrame:
+        data = {}
+        for col in self.cols:
+            values = pd.Series([operator.get(col) for operator in operators])
+            if col not in self.kinds:
+                data[col] = values
+            elif self.kinds[col] is None:
+                data[col] = pd.to_numeric(values, errors="coerce").astype("float32")
+            else:
+                data[col] = pd.Categorical(
+                    values.map(str, na_action="ignore"), dtype=self.kinds[col]
+                )
+        return pd.DataFrame(data)
+
+    def predict(self, operators: list[dict]) -> list[float]:
+        return self.predictor.predict(self.frame(operators)).tolist()
+
+
+class PendingRows:
+    def __init__(self, key: tuple, operators: list[dict], hashes: list[bytes]):
+        self.key = key
+        self.operators = operators
+        self.hashes = hashes
+        self.predictions: Optional[list[float]] = None
+        self.error: Optional[BaseException] = None
+        self.done = threading.Event()
+
+
+class PredictionService:
+    def __init__(self, artifact_root: Path):
+        self.artifact_root = artifact_root
+        self.cache_rows = int(os.getenv("PREDICT_CACHE_ROWS", "1000000"))
+        self.batch_rows = int(os.getenv("PREDICT_BATCH_ROWS", "4096"))
+        self.batch_s = float(os.getenv("PREDICT_BATCH_MS", "2")) / 1000
+
+        self.models_lock = threading.Lock()
+        self.models: dict[tuple, Model] = {}
+        self.cache_lock = threading.Lock()
+        self.cache: OrderedDict[tuple, float] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.num_requests = 0
+        self.latencies_s = deque(
+            maxlen=int(os.getenv("PREDICT_LATENCY_WINDOW", "10000"))
+        )
+
+        self.pending = queue.Queue()
+        self.batcher = threading.Thread(target=self.run_batches, daemon=True)
+        self.batcher.start()
+
+    def model(self, key: tuple) -> Model:
+        with self.models_lock:
+            if key not in self.models:
+                self.models[key] = Model(self.artifact_root, *key)
+            return self.models[key]
+
+    def predict(self, key: tuple, operators: list[dict]) -> tuple[list[float], int]:
+        model = self.model(key)
+        hashes = [model.row_hash(operator) for operator in operators]
+        predictions = [None] * len(operators)
+        missed = []
+        with self.cache_lock:
+            for i, row_hash in enumerate(hashes):
+                cached = self.cache.get((key, row_hash))
+                if cached is None:
+                    missed.append(i)
+                else:
+                    self.cache.move_to_end((key, row_hash))
+                    predictions[i] = cached
+            self.hits += len(operators) - len(missed)
+            self.misses += len(missed)
+
+        if len(missed) > 0:
+            rows = PendingRows(
+                key, [operators[i] for i in missed], [hashes[i] for i in missed]
+            )
+            self.pending.put(rows)
+            rows.done.wait()
+            if rows.error is not None:
+                raise rows.error
+            for i, prediction in zip(missed, rows.predictions):
+                predictions[i] = prediction
+        return predictions, len(operators) - len(missed)
+
+    def run_batches(self):
+        while True:
+            batch = [self.pending.get()]
+            num_rows = len(batch[0].operators)
+            deadline = time.time() + self.batch_s
+            while num_rows < self.batch_rows:
+                timeout_s = deadline - time.time()
+                if timeout_s <= 0:
+                    break
+                try:
+                    batch.append(self.pending.get(timeout=timeout_s))
+                except queue.Empty:
+                    break
+                num_rows += len(batch[-1].operators)
+
+            by_model = {}
+            for rows in batch:
+                by_model.setdefault(rows.key, []).append(rows)
+            for key, model_rows in by_model.items():
+                self.predict_batch(key, model_rows)
+
+    def predict_batch(self, key: tuple, model_rows: list[PendingRows]):
+        # Rows repeated across requests in the batch are only predicted once.
+        unique = {}
+        for rows in model_rows:
+            for row_hash, operator in zip(rows.hashes, rows.operators):
+                unique.setdefault(row_hash, operator)
+        try:
+            predictions = self.model(key).predict(list(unique.values()))
+        except BaseException as e:
+            for rows in model_rows:
+                rows.error = e
+                rows.done.set()
+            return
+        predicted = dict(zip(unique, predictions))
+        with self.cache_lock:
+            for row_hash, prediction in predicted.items():
+                self.cache[(key, row_hash)] = prediction
+                self.cache.move_to_end((key, row_hash))
+            while len(self.cache) > self.cache_rows:
+                self.cache.popitem(last=False)
+        for rows in model_rows:
+            rows.predictions = [predicted[row_hash] for row_hash in rows.hashes]
+            rows.done.set()
+
+    def record(self, latency_s: float):
+        with self.cache_lock:
+            self.num_requests += 1
+            self.latencies_s.append(latency_s)
+
+    def stats(self) -> dict:
+        with self.cache_lock:
+            latencies_ms = np.array(self.latencies_s) * 1000
+            stats = {
+                "requests": self.num_requests,
+                "hits": self.hits,
+                "misses": self.misses,
+                "cached_rows": len(self.cache),
+            }
+        with self.models_lock:
+            stats["models"] = ["/".join(key) for key in self.models]
+        for pct in [50, 90, 99]:
+            stats[f"p{pct}_ms"] = (
+                float(np.percentile(latencies_ms, pct))
+                if len(latencies_ms) > 0
+                else None
+            )
+        return stats
+
+    def handle(self, request: dict) -> dict:
+        op = request.get("op", "predict")
+        if op == "stats":
+            return self.stats()
+        if op != "predict":
+            return {"error": f"Unknown op: {op}"}
+        start = time.time()
+        key = (str(request["benchmark"]), str(request["sf"]), str(request["expt"]))
+        predictions, hits = self.predict(key, request["operators"])
+        self.record(time.time() - start)
+        return {"predictions": predictions, "hits": hits}
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.service.handle(ujson.loads(line))
+            except Exception as e:
+                response = {"error": f"{type(e).__name__}: {e}"}
+            self.wfile.write(ujson.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class TcpServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(service: PredictionService, address=None):
+    address = default_address() if address is None else address
+    if isinstance(address, str):
+        Path(address).unlink(missing_ok=True)
+        server = UnixServer(address, RequestHandler)
+    else:
+        server = TcpServer(address, RequestHandler)
+    server.service = service
+    print(f"Serving predictions on {address}.")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if isinstance(address, str):
+            Path(address).unlink(missing_ok=True)
+
+
+class PredictionClient:
+    def __init__(self, address=None):
+        address = default_address() if address is None else address
+        family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.connect(address)
+        self.file = self.sock.makefile("rwb")
+
+    def request(self, request: dict) -> dict:
+        self.file.write(ujson.dumps(request).encode() + b"\n")
+        self.file.flush()
+        response = ujson.loads(self.file.readline())
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        return response
+
+    def predict(self, benchmark: str, sf, expt: str, operators: list[dict]) -> list:
+        request = {
+            "op": "predict",
+            "benchmark": benchmark,
+            "sf": str(sf),
+            "expt": expt,
+            "operators": operators,
+        }
+        return self.request(request)["predictions"]
+
+    def stats(self) -> dict:
+        return self.request({"op": "stats"})
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+def main():
+    service = PredictionService(Path(os.getenv("ARTIFACT_ROOT")))
+    try:
+        serve(service)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(ujson.dumps(service.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+import json
+import os
+import re
+import threading
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from manifest import load_manifest
+
+# Runtimes of every query run so far, across configs and scale factors, in one
+# append-only log. Each line is
+# "<benchmark>\t<sf>\t<expt>\t<key>\t<state>\t<seconds>", where a timeout's
+# seconds is the statement_timeout it exceeded, i.e., a lower bound.
+HISTORY_NAME = "runtimes.log"
+EXECUTION_TIME = re.compile(r"['\"]Execution Time['\"]: ([0-9.eE+-]+)")
+# Used when backfilling from artifacts, the runners' default Config.timeout_s.
+BACKFILL_TIMEOUT_S = 60 * 5
+
+
+class Observation(NamedTuple):
+    sf: int
+    expt: str
+    state: str
+    seconds: float
+
+
+def history_key(benchmark: str, manifest_key: str) -> str:
+    # TPC-H seeds only change query parameters, so a query's history is shared
+    # across seeds. DSB's data distribution varies, so each seed is kept apart.
+    parts = Path(manifest_key).parts
+    if benchmark == "dsb":
+        return "/".join(parts[-2:])
+    return parts[-1]
+
+
+def backfill(artifact_root: Path) -> list[str]:
+    # Recover runtimes from runs that predate the history log.
+    lines = []
+    for root in sorted(artifact_root.glob("experiment/*/*/sf_*")):
+        expt, benchmark, sf = root.parts[-3], root.parts[-2], root.name[len("sf_") :]
+        for key, state in sorted(load_manifest(root).items()):
+            if state == "timeout":
+                seconds = BACKFILL_TIMEOUT_S
+            elif state == "ok":
+                res_path = root / f"{key}.res"
+                if not res_path.exists():
+                    continue
+                match = EXECUTION_TIME.search(res_path.read_text())
+                if match is None:
+                    continue
+                seconds = float(match.group(1)) / 1000
+            else:
+                continue
+            lines.append(
+                f"{benchmark}\t{sf}\t{expt}\t{history_key(benchmark, key)}\t"
+                f"{state}\t{seconds}"
+            )
+    return lines
+
+
+class RuntimeHistory:
+    def __init__(self, artifact_root: Path):
+        self.path = artifact_root / "cache" / HISTORY_NAME
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if not self.path.exists():
+            tmp_path = self.path.with_suffix(f".tmp{os.getpid()}")
+            with open(tmp_path, "w") as f:
+                for line in backfill(artifact_root):
+                    print(line, file=f)
+            os.replace(tmp_path, self.path)
+
+        self.lock = threading.Lock()
+        self.entries: dict[tuple[str, str], list[Observation]] = {}
+        with open(self.path) as f:
+            for line in f:
+                # A torn final line from a crash is simply ignored.
+                if not line.endswith("\n"):
+                    continue
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) != 6:
+                    continue
+                benchmark, sf, expt, key, state, seconds = fields
+                self.entries.setdefault((benchmark, key), []).append(
+                    Observation(int(sf), expt, state, float(seconds))
+                )
+        self.file = open(self.path, "a")
+
+    def observations(self, benchmark: str, key: str) -> list[Observation]:
+        with self.lock:
+            return list(self.entries.get((benchmark, key), []))
+
+    def record(
+        self,
+        benchmark: str,
+        sf: int,
+        expt: str,
+        key: str,
+        state: str,
+        seconds: float,
+    ):
+        with self.lock:
+            print(
+                f"{benchmark}\t{sf}\t{expt}\t{key}\t{state}\t{seconds}",
+                file=self.file,
+                flush=True,
+            )
+            self.entries.setdefault((benchmark, key), []).append(
+                Observation(sf, expt, state, seconds)
+            )
+
+    def close(self):
+        self.file.close()
+
+
+class Prediction(NamedTuple):
+    skip: bool
+    timeout_s: float
+
+
+class RuntimePredictor:
+    # Runtimes are assumed to scale linearly with SF. A query is skipped, i.e.,
+    # recorded as a timeout without running it, if:
+    # - it already hit the config's full timeout at this SF (e.g., for another
+    #   TPC-H seed), or
+    # - for DSB's default config at SF > 1, its SF1 runtime or timeout scales to
+    #   at least the timeout, as the runners always did, or
+    # - with RUNNER_PREDICT=1, every observation of this config at this or a
+    #   smaller SF scales to at least the timeout.
+    # Other configs never cause a skip, since e.g. bytejack's early stop and
+    # sampling exist for exactly the queries that time out under default.
+    #
+    # With RUNNER_PREDICT=1 and RUNNER_TIMEOUT_SLACK > 0, a query that ran to
+    # completion under any config at any SF gets statement_timeout = slack * its
+    # largest scaled runtime, at least RUNNER_TIMEOUT_FLOOR_S and at most the
+    # config's timeout. If that shorter timeout is hit, the runner retries with
+    # the config's timeout, so other configs only ever cost a retry.
+
+    def __init__(
+        self,
+        artifact_root: Path,
+        benchmark: str,
+        sf: int,
+        expt: str,
+        timeout_s: float,
+    ):
+        self.history = RuntimeHistory(artifact_root)
+        self.benchmark = benchmark
+        self.sf = sf
+        self.expt = expt
+        self.timeout_s = timeout_s
+        self.enabled = int(os.getenv("RUNNER_PREDICT", "1")) == 1
+        self.slack = float(os.getenv("RUNNER_TIMEOUT_SLACK", "0"))
+        self.floor_s = float(os.getenv("RUNNER_TIMEOUT_FLOOR_S", "10"))
+
+        self.lock = threading.Lock()
+        self.num_skipped = 0
+        self.num_retried = 0
+        self.saved_s = 0.0
+        self.wasted_s = 0.0
+
+    def scaled(self, observations: list[Observation]) -> list[tuple[str, float]]:
+        return [(o.state, o.seconds * self.sf / o.sf) for o in observations]
+
+    def timed_out(self, observations: list[Observation]) -> bool:
+        # A timeout is a lower bound, so it only predicts one when scaled up.
+        scaled = self.scaled([o for o in observations if o.sf <= self.sf])
+        return len(scaled) > 0 and min(s for _, s in scaled) >= self.timeout_s
+
+    def predict(self, key: str) -> Prediction:
+        observations = self.history.observations(self.benchmark, key)
+        own = [o for o in observations if o.expt == self.expt]
+        if any(
+            o.sf == self.sf and o.state == "timeout" and o.seconds >= self.timeout_s
+            for o in own
+        ):
+            return Prediction(True, self.timeout_s)
+        if self.benchmark == "dsb" and self.expt == "default" and self.sf > 1:
+            if self.timed_out([o for o in own if o.sf == 1]):
+                return Prediction(True, self.timeout_s)
+        if not self.enabled:
+            return Prediction(False, self.timeout_s)
+
+        if self.timed_out(own):
+            return Prediction(True, self.timeout_s)
+        ok = [s for state, s in self.scaled(observations) if state == "ok"]
+        if self.slack <= 0 or len(ok) == 0:
+            return Prediction(False, self.timeout_s)
+        timeout_s = min(self.timeout_s, max(self.floor_s, self.slack * max(ok)))
+        return Prediction(False, timeout_s)
+
+    def skipped(self):
+        with self.lock:
+            self.num_skipped += 1
+            self.saved_s += self.timeout_s
+
+    def finished(self, key: str, state: str, seconds: float, timeout_s: float):
+        if state == "timeout":
+            # Recorded as a lower bound of the timeout actually applied.
+            seconds = timeout_s
+            if timeout_s < self.timeout_s:
+                # The runner retries the query with the config's timeout.
+                with self.lock:
+                    self.num_retried += 1
+                    self.wasted_s += timeout_s
+        self.history.record(self.benchmark, self.sf, self.expt, key, state, seconds)
+
+    def report(self, root: Optional[Path] = None) -> dict:
+        report = {
+            "Benchmark": self.benchmark,
+            "SF": self.sf,
+            "Experiment": self.expt,
+            "Skipped": self.num_skipped,
+            "Retried": self.num_retried,
+            "Saved (s)": self.saved_s,
+            "Wasted (s)": self.wasted_s,
+        }
+        print(
+            f"{self.expt} {self.benchmark} sf_{self.sf}: "
+            f"skipped {self.num_skipped} predicted timeouts, "
+            f"retried {self.num_retried} cut by adaptive timeouts, "
+            f"saved {self.saved_s:.0f} s, wasted {self.wasted_s:.0f} s."
+        )
+        if root is not None:
+            with open(root / "predictor.json", "w") as f:
+                json.dump(report, f, indent=2)
+        return report
+
+    def close(self):
+        self.history.close()
+
+
+def baseline_dsb_skips(artifact_root: Path, sf: int, timeout_s: float) -> set[str]:
+    # What dsb_run skipped at SF > 1 before the runtime history: every query
+    # whose default SF1 run timed out, or whose SF1 Execution Time scales to at
+    # least the timeout.
+    root = artifact_root / "experiment" / "default" / "dsb" / "sf_1"
+    skips = set()
+    for key, state in load_manifest(root).items():
+        if state == "timeout":
+            skips.add(key)
+        elif state == "ok":
+            res_path = root / f"{key}.res"
+            match = EXECUTION_TIME.search(res_path.read_text())
+            if match is not None and float(match.group(1)) / 1000 * sf >= timeout_s:
+                skips.add(key)
+    return skips
+
+
+def main():
+    # Checks that DSB's default config at DSB_SF skips at least the queries that
+    # the runner skipped before the runtime history, regardless of RUNNER_PREDICT.
+    artifact_root = Path(os.getenv("ARTIFACT_ROOT"))
+    sf = int(os.getenv("DSB_SF"))
+    expected = baseline_dsb_skips(artifact_root, sf, BACKFILL_TIMEOUT_S)
+    predictor = RuntimePredictor(
+        artifact_root, "dsb", sf, "default", BACKFILL_TIMEOUT_S
+    )
+    try:
+        missing = sorted(
+            key
+            for key in expected
+            if not predictor.predict(history_key("dsb", key)).skip
+        )
+    finally:
+        predictor.close()
+    if len(missing) > 0:
+        raise Exception(f"DSB sf_{sf} would run baseline timeouts: {missing}")
+    print(f"DSB sf_{sf}: all {len(expected)} baseline timeouts are skipped.")
+
+
+if __name__ == "__main__":
+    main()
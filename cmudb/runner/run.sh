@@ -31,6 +31,28 @@ export POSTGRES_HOST="localhost"
 export POSTGRES_PORT=15799
 export POSTGRES_PID=-1
 
+export RUNNER_WORKERS=1
+export RUNNER_PIN_SEED=0
+export RUNNER_BACKEND="sync"
+export RUNNER_SINK="none"
+export RUNNER_PLAN_FETCH="json"
+export RUNNER_PREWARM_WORKERS=4
+export RUNNER_PREDICT=1
+export RUNNER_TIMEOUT_SLACK=0
+export RUNNER_TIMEOUT_FLOOR_S=10
+export RUNNER_ORDER="file"
+export RUNNER_FOOTPRINT="parse"
+export RUNNER_ISOLATE=0
+export ORCH_INSTANCES=1
+export ORCH_CLONE="datadir"
+export ORCH_MEMORY_MB=""
+export LOAD_WORKERS=4
+export LOAD_BULK=0
+export LOAD_GENERATE=0
+export LOAD_CHUNKS=4
+export VACUUM_WORKERS=4
+export VACUUM_MEMORY_MB=""
+
 if [ "${HOSTNAME}" = "dev8" ]; then
   export TPCH_REPO_ROOT="${ROOT_DIR}/build/tpch-kit"
   export TPCH_DATA_ROOT="/mnt/nvme1n1/kapi/tpch/tpch-data/"
@@ -222,11 +244,15 @@ load_tpch_sf() {
 
   POSTGRES_DB="tpch_sf_${SF}"
   if ! sql_database_exists; then
-    TPCH_SF="${SF}" ./cmudb/setup/tpch/tpch_data.sh
     sql_create_database
-    TPCH_SF="${SF}" python3 ./cmudb/runner/tpch_load.py
-    POSTGRES_DB="${OLD_POSTGRES_DB}"
   fi
+  # A complete load needs no data files, so they are not regenerated.
+  if [ "${LOAD_GENERATE}" != "1" ] && ! TPCH_SF="${SF}" python3 ./cmudb/runner/tpch_load.py complete; then
+    TPCH_SF="${SF}" ./cmudb/setup/tpch/tpch_data.sh
+  fi
+  # Resumes from the load catalog, a no-op if the database is already loaded.
+  TPCH_SF="${SF}" python3 ./cmudb/runner/tpch_load.py
+  POSTGRES_DB="${OLD_POSTGRES_DB}"
 }
 
 run_tpch_sf() {
@@ -234,7 +260,11 @@ run_tpch_sf() {
   local OLD_POSTGRES_DB=${POSTGRES_DB}
 
   POSTGRES_DB="tpch_sf_${SF}"
-  TPCH_SF="${SF}" python3 ./cmudb/runner/tpch_run.py
+  if [ "${ORCH_INSTANCES}" -gt 1 ]; then
+    TPCH_SF="${SF}" python3 ./cmudb/runner/orchestrator.py tpch
+  else
+    TPCH_SF="${SF}" python3 ./cmudb/runner/tpch_run.py
+  fi
   POSTGRES_DB="${OLD_POSTGRES_DB}"
 }
 
@@ -250,11 +280,15 @@ load_dsb_sf() {
 
   POSTGRES_DB="dsb_sf_${SF}"
   if ! sql_database_exists; then
-    DSB_SF="${SF}" ./cmudb/setup/dsb/dsb_data.sh
     sql_create_database
-    DSB_SF="${SF}" python3 ./cmudb/runner/dsb_load.py
-    POSTGRES_DB="${OLD_POSTGRES_DB}"
   fi
+  # A complete load needs no data files, so they are not regenerated.
+  if [ "${LOAD_GENERATE}" != "1" ] && ! DSB_SF="${SF}" python3 ./cmudb/runner/dsb_load.py complete; then
+    DSB_SF="${SF}" ./cmudb/setup/dsb/dsb_data.sh
+  fi
+  # Resumes from the load catalog, a no-op if the database is already loaded.
+  DSB_SF="${SF}" python3 ./cmudb/runner/dsb_load.py
+  POSTGRES_DB="${OLD_POSTGRES_DB}"
 }
 
 run_dsb_sf() {
@@ -262,16 +296,15 @@ run_dsb_sf() {
   local OLD_POSTGRES_DB=${POSTGRES_DB}
 
   POSTGRES_DB="dsb_sf_${SF}"
-  DSB_SF="${SF}" python3 ./cmudb/runner/dsb_run.py
-  POSTGRES_DB="${OLD_POSTGRES_DB}"
-
-  if [ "${SF}" = "1" ]; then
-    cd "${ROOT_DIR}"
-    ls artifact/experiment/default/dsb/sf_1/default/"${DSB_QUERY_TRAIN_SEED}"/query*.timeout > cmudb/env/"${HOSTNAME}_dsb_sf1_timeout_${DSB_QUERY_TRAIN_SEED}.txt"
-    grep -oE "'Execution Time.*" artifact/experiment/default/dsb/sf_1/default/"${DSB_QUERY_TRAIN_SEED}"/query*.res | cut -d'}' -f1 > cmudb/env/"${HOSTNAME}_dsb_sf1_runtime_${DSB_QUERY_TRAIN_SEED}.txt"
-    ls artifact/experiment/default/dsb/sf_1/default/"${DSB_QUERY_TEST_SEED}"/query*.timeout > cmudb/env/"${HOSTNAME}_dsb_sf1_timeout_${DSB_QUERY_TEST_SEED}.txt"
-    grep -oE "'Execution Time.*" artifact/experiment/default/dsb/sf_1/default/"${DSB_QUERY_TEST_SEED}"/query*.res | cut -d'}' -f1 > cmudb/env/"${HOSTNAME}_dsb_sf1_runtime_${DSB_QUERY_TEST_SEED}.txt"
+  if [ "${SF}" != "1" ]; then
+    DSB_SF="${SF}" python3 ./cmudb/runner/predictor.py
+  fi
+  if [ "${ORCH_INSTANCES}" -gt 1 ]; then
+    DSB_SF="${SF}" python3 ./cmudb/runner/orchestrator.py dsb
+  else
+    DSB_SF="${SF}" python3 ./cmudb/runner/dsb_run.py
   fi
+  POSTGRES_DB="${OLD_POSTGRES_DB}"
 }
 
 main "$@"
@@ -0,0 +1,220 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import pglast
+import sqlalchemy.exc
+from corpus import corpus
+from pglast import ast, visitors
+from sqlalchemy import Connection, Engine
+from tablesample import CteVisitor
+from util import conn_execute
+
+# Units run in file order by default (RUNNER_ORDER=file). With
+# RUNNER_ORDER=schedule, units that touch the same relations run back to back,
+# so that a relation that does not fit in shared buffers is read once per group
+# instead of once per unit. Footprints come from a pglast scan of the query text
+# (RUNNER_FOOTPRINT=parse) or from the relations and indexes in its plain
+# EXPLAIN plan (RUNNER_FOOTPRINT=explain). Scheduling pays off with
+# RUNNER_PIN_SEED=0, where a unit is a single query of a single seed.
+#
+# Reordering changes which buffers a query starts with. With RUNNER_ISOLATE=1,
+# each group's footprint is prewarmed before its first unit runs, so every
+# query starts from its own relations being resident regardless of what ran
+# before it.
+FOOTPRINTS = ["parse", "explain"]
+
+
+class RangeVarVisitor(visitors.Visitor):
+    def __init__(self):
+        super().__init__()
+        self.names = set()
+
+    def visit_RangeVar(self, ancestors, node: ast.RangeVar):
+        self.names.add(node.relname)
+
+
+def parse_footprint(query: str) -> set[str]:
+    tree = pglast.parse_sql(query)
+    ctes = CteVisitor()
+    ctes(tree)
+    names = RangeVarVisitor()
+    names(tree)
+    return names.names - ctes.names
+
+
+def plan_relations(plan: dict) -> set[str]:
+    names = set()
+    for name in ["Relation Name", "Index Name"]:
+        if name in plan:
+            names.add(plan[name])
+    for child in plan.get("Plans", []):
+        names |= plan_relations(child)
+    return names
+
+
+def explain_footprint(conn: Connection, query: str) -> set[str]:
+    # Statements that cannot be planned up front (e.g., TPC-H Q15 selecting from
+    # a view that an earlier statement creates) fall back to the query text.
+    try:
+        result = conn_execute(conn, f"EXPLAIN (FORMAT JSON) {query}", verbose=False)
+    except sqlalchemy.exc.DBAPIError:
+        return parse_footprint(query)
+    return plan_relations(result.fetchone()[0][0]["Plan"])
+
+
+def relation_sizes(conn: Connection) -> tuple[dict[str, int], dict[str, list[str]]]:
+    # Main fork blocks of every table and index, and every table's indexes.
+    rows = conn_execute(
+        conn,
+        "SELECT c.relname, "
+        "pg_relation_size(c.oid) / current_setting('block_size')::int, "
+        "t.relname "
+        "FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "LEFT JOIN pg_index i ON i.indexrelid = c.oid "
+        "LEFT JOIN pg_class t ON t.oid = i.indrelid "
+        "WHERE n.nspname = current_schema() AND c.relkind IN ('r', 'i')",
+        verbose=False,
+    ).fetchall()
+    sizes = {}
+    indexes = {}
+    for relname, num_blocks, table in rows:
+        sizes[relname] = num_blocks
+        if table is not None:
+            indexes.setdefault(table, []).append(relname)
+    return sizes, indexes
+
+
+def shared_buffers(conn: Connection) -> int:
+    # pg_settings reports shared_buffers in blocks.
+    return int(
+        conn_execute(
+            conn,
+            "SELECT setting FROM pg_settings WHERE name = 'shared_buffers'",
+            verbose=False,
+        ).fetchone()[0]
+    )
+
+
+class Footprints:
+    def __init__(self, conn: Connection, method: str):
+        if method not in FOOTPRINTS:
+            raise Exception(f"Unknown RUNNER_FOOTPRINT: {method}")
+        self.conn = conn
+        self.method = method
+        self.sizes, self.indexes = relation_sizes(conn)
+        self.memo = {}
+
+    def query(self, query: str) -> frozenset[str]:
+        key = hashlib.blake2b(query.encode(), digest_size=16).digest()
+        if key not in self.memo:
+            if self.method == "explain":
+                names = explain_footprint(self.conn, query)
+            else:
+                # Any of a table's indexes may be used, so all of them count.
+                names = set()
+                for name in parse_footprint(query):
+                    names.add(name)
+                    names.update(self.indexes.get(name, []))
+            # Views and objects created by the query itself are not relations.
+            self.memo[key] = frozenset(name for name in names if name in self.sizes)
+        return self.memo[key]
+
+    def unit(self, unit) -> frozenset[str]:
+        _, query_paths = unit
+        names = set()
+        for query_path in query_paths:
+            for query in corpus().queries(query_path):
+                names |= self.query(query)
+        return frozenset(names)
+
+    def blocks(self, names) -> int:
+        return sum(self.sizes[name] for name in names)
+
+
+def order_groups(
+    footprints: Footprints, groups: list[frozenset[str]], capacity: int
+) -> list[frozenset[str]]:
+    # Greedily picks the group with the most blocks already resident, under an
+    # LRU model of shared buffers. Ties, including the very first pick, go to
+    # the largest footprint and then to file order.
+    resident = OrderedDict()
+    remaining = list(groups)
+    ordered = []
+    while len(remaining) > 0:
+        best = max(
+            range(len(remaining)),
+            key=lambda i: (
+                footprints.blocks(name for name in remaining[i] if name in resident),
+                footprints.blocks(remaining[i]),
+                -i,
+            ),
+        )
+        group = remaining.pop(best)
+        ordered.append(group)
+        for name in sorted(group, key=lambda name: -footprints.sizes[name]):
+            resident.pop(name, None)
+            resident[name] = footprints.sizes[name]
+        while sum(resident.values()) > capacity and len(resident) > 1:
+            resident.popitem(last=False)
+    return ordered
+
+
+class Schedule:
+    def __init__(self, engine: Engine, conn: Connection, units: list, verbose=False):
+        self.engine = engine
+        self.order = os.getenv("RUNNER_ORDER", "file")
+        self.isolate = int(os.getenv("RUNNER_ISOLATE", "0")) == 1
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.warmed = set()
+        # id(unit) -> footprint, only when scheduling.
+        self.footprint = {}
+
+        if self.order == "file":
+            self.units = list(units)
+            return
+        if self.order != "schedule":
+            raise Exception(f"Unknown RUNNER_ORDER: {self.order}")
+
+        footprints = Footprints(conn, os.getenv("RUNNER_FOOTPRINT", "parse"))
+        grouped = {}
+        for unit in units:
+            footprint = footprints.unit(unit)
+            self.footprint[id(unit)] = footprint
+            grouped.setdefault(footprint, []).append(unit)
+        groups = order_groups(footprints, list(grouped), shared_buffers(conn))
+        self.units = [unit for group in groups for unit in grouped[group]]
+        if self.isolate:
+            conn_execute(
+                conn, "CREATE EXTENSION IF NOT EXISTS pg_prewarm", verbose=verbose
+            )
+        if verbose:
+            for group in groups:
+                print(
+                    f"{len(grouped[group]):>4} units "
+                    f"{footprints.blocks(group):>12} blocks: {sorted(group)}"
+                )
+
+    def prewarm(self, footprint: frozenset[str]):
+        with self.lock:
+            if footprint in self.warmed:
+                return
+            self.warmed.add(footprint)
+        with self.engine.connect() as conn:
+            conn_execute(conn, "SET statement_timeout = '0s'", verbose=self.verbose)
+            for relname in sorted(footprint):
+                conn_execute(
+                    conn, f"SELECT pg_prewarm('{relname}')", verbose=self.verbose
+                )
+
+    def wrap(self, fn):
+        if not self.isolate or len(self.footprint) == 0:
+            return fn
+
+        def run_unit(unit):
+            self.prewarm(self.footprint[id(unit)])
+            fn(unit)
+
+        return run_unit
@@ -0,0 +1,129 @@
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# One row per finished query. Plan trees are arbitrarily deep and their keys vary
+# by node type, so the plan is kept as its EXPLAIN (FORMAT JSON) text.
+SCHEMA = pa.schema(
+    [
+        ("Key", pa.string()),
+        ("Seed", pa.string()),
+        ("Query", pa.string()),
+        ("State", pa.string()),
+        ("Plan", pa.large_string()),
+    ]
+)
+SINK_DIR = "results"
+SUFFIXES = {"arrow": ".arrows", "parquet": ".parquet"}
+
+
+class ResultSink:
+    def __init__(
+        self,
+        root: Path,
+        fmt: str,
+        batch_rows: int = 256,
+        segment_rows: int = 65536,
+    ):
+        assert fmt in SUFFIXES, f"Unknown sink format: {fmt}"
+        self.sink_root = root / SINK_DIR
+        self.sink_root.mkdir(parents=True, exist_ok=True)
+        self.fmt = fmt
+        self.batch_rows = batch_rows
+        self.segment_rows = segment_rows
+
+        self.lock = threading.Lock()
+        self.rows = {name: [] for name in SCHEMA.names}
+        self.writer = None
+        self.segment_num = 0
+        self.segment_written = 0
+        # Resumed runs never append to an earlier run's segments.
+        self.run_id = f"{time.time_ns()}-{os.getpid()}"
+
+    def append(self, key: str, state: str, plan: Optional[str]):
+        key_path = Path(key)
+        with self.lock:
+            self.rows["Key"].append(key)
+            self.rows["Seed"].append(key_path.parent.name)
+            self.rows["Query"].append(key_path.name)
+            self.rows["State"].append(state)
+            self.rows["Plan"].append(plan)
+            if len(self.rows["Key"]) >= self.batch_rows:
+                self._flush()
+
+    def _open(self):
+        segment_path = (
+            self.sink_root
+            / f"segment-{self.run_id}-{self.segment_num:06d}{SUFFIXES[self.fmt]}"
+        )
+        if self.fmt == "arrow":
+            # The streaming format stays readable up to the last complete batch.
+            self.writer = pa.ipc.new_stream(segment_path, SCHEMA)
+        else:
+            self.writer = pq.ParquetWriter(segment_path, SCHEMA)
+        self.segment_num += 1
+        self.segment_written = 0
+
+    def _flush(self):
+        if len(self.rows["Key"]) == 0:
+            return
+        if self.writer is None:
+            self._open()
+        batch = pa.RecordBatch.from_pydict(self.rows, schema=SCHEMA)
+        if self.fmt == "arrow":
+            self.writer.write_batch(batch)
+        else:
+            self.writer.write_table(pa.Table.from_batches([batch]))
+        self.segment_written += batch.num_rows
+        self.rows = {name: [] for name in SCHEMA.names}
+        if self.segment_written >= self.segment_rows:
+            self.writer.close()
+            self.writer = None
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+
+
+def make_sink(root: Path) -> Optional[ResultSink]:
+    fmt = os.getenv("RUNNER_SINK", "none")
+    if fmt == "none":
+        return None
+    return ResultSink(root, fmt)
+
+
+def read_segment(segment_path: Path) -> Optional[pa.Table]:
+    if segment_path.suffix == SUFFIXES["parquet"]:
+        try:
+            return pq.read_table(segment_path, schema=SCHEMA)
+        except pa.ArrowInvalid:
+            # Segment left open by a crash, no footer.
+            return None
+    batches = []
+    try:
+        with pa.ipc.open_stream(segment_path) as reader:
+            for batch in reader:
+                batches.append(batch)
+    except pa.ArrowInvalid:
+        # Torn final batch from a crash.
+        pass
+    return pa.Table.from_batches(batches, schema=SCHEMA)
+
+
+def read_results(root: Path) -> pa.Table:
+    tables = []
+    for segment_path in sorted((root / SINK_DIR).glob("segment-*")):
+        table = read_segment(segment_path)
+        if table is not None:
+            tables.append(table)
+    if len(tables) == 0:
+        return SCHEMA.empty_table()
+    return pa.concat_tables(tables)
@@ -0,0 +1,154 @@
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from typing import Optional
+
+import pglast
+import psycopg
+from pglast import ast, visitors
+from pglast.stream import RawStream
+from util import conninfo
+
+# Queries are parsed once per (query, policy, nesting) into a template whose
+# sampled relations carry a placeholder method. Every (method, seed) after that
+# is a string substitution on the template, memoized as well.
+PLACEHOLDER = "TABLESAMPLE __tablesample__()"
+# A RangeVar is only a sampled relation in these positions, not e.g. as the
+# target of CREATE VIEW or INSERT.
+FROM_MEMBERS = {"fromClause", "larg", "rarg"}
+
+
+class SamplePolicy(ABC):
+    @abstractmethod
+    def key(self) -> tuple:
+        raise NotImplementedError
+
+    @abstractmethod
+    def sample(self, relname: str) -> bool:
+        raise NotImplementedError
+
+
+class TablePolicy(SamplePolicy):
+    # Samples exactly the given tables.
+    def __init__(self, tables: set[str]):
+        self.tables = frozenset(tables)
+
+    def key(self) -> tuple:
+        return "tables", tuple(sorted(self.tables))
+
+    def sample(self, relname: str) -> bool:
+        return relname in self.tables
+
+
+class SizePolicy(SamplePolicy):
+    # Samples tables of at least min_blocks blocks; the default is every table.
+    # Views cannot be sampled and are never chosen.
+    def __init__(self, min_blocks: int = 0):
+        self.min_blocks = min_blocks
+        self.lock = threading.Lock()
+        self.sizes: Optional[dict[str, int]] = None
+
+    def key(self) -> tuple:
+        return "size", self.min_blocks
+
+    def load_sizes(self) -> dict[str, int]:
+        with self.lock:
+            if self.sizes is None:
+                with psycopg.connect(conninfo()) as conn:
+                    rows = conn.execute(
+                        "SELECT relname, "
+                        "pg_relation_size(oid) / current_setting('block_size')::int "
+                        "FROM pg_class "
+                        "WHERE relkind IN ('r', 'm') "
+                        "AND relnamespace = current_schema()::regnamespace"
+                    ).fetchall()
+                self.sizes = dict(rows)
+            return self.sizes
+
+    def sample(self, relname: str) -> bool:
+        blocks = self.load_sizes().get(relname)
+        return blocks is not None and blocks >= self.min_blocks
+
+
+class SampleVisitor(visitors.Visitor):
+    def __init__(self, policy: SamplePolicy, nested: bool, ctes: set[str]):
+        super().__init__()
+        self.policy = policy
+        self.nested = nested
+        self.ctes = ctes
+        self.num_sampled = 0
+
+    def visit_RangeVar(self, ancestors, node: ast.RangeVar):
+        members = [m for m in ancestors._iter_members() if isinstance(m, str)]
+        if len(members) == 0 or members[-1] not in FROM_MEMBERS:
+            return None
+        if not self.nested and ast.SubLink in ancestors:
+            return None
+        if node.schemaname is None and node.relname in self.ctes:
+            return None
+        if not self.policy.sample(node.relname):
+            return None
+        self.num_sampled += 1
+        return ast.RangeTableSample(
+            relation=node,
+            method=(ast.String(sval="__tablesample__"),),
+            args=(),
+            repeatable=None,
+        )
+
+
+class CteVisitor(visitors.Visitor):
+    def __init__(self):
+        super().__init__()
+        self.names = set()
+
+    def visit_CommonTableExpr(self, ancestors, node: ast.CommonTableExpr):
+        self.names.add(node.ctename)
+
+
+_templates: dict[tuple, str] = {}
+_rewrites: dict[tuple, str] = {}
+
+
+class TableSampler:
+    def __init__(
+        self,
+        sample_method: str,
+        sample_seed: str,
+        nested: bool = True,
+        policy: Optional[SamplePolicy] = None,
+    ):
+        # e.g., sample_method="BERNOULLI (10)", sample_seed="REPEATABLE (15721)".
+        # Nested samples relations in subqueries (SubLinks) too; otherwise only
+        # relations reachable through FROM clauses and CTEs are sampled.
+        self.sample_method = sample_method
+        self.sample_seed = sample_seed
+        self.nested = nested
+        self.policy = policy if policy is not None else SizePolicy()
+
+    def template(self, query_digest: bytes, query: str) -> str:
+        key = (query_digest, self.nested, self.policy.key())
+        if key not in _templates:
+            tree = pglast.parse_sql(query)
+            ctes = CteVisitor()
+            ctes(tree)
+            visitor = SampleVisitor(self.policy, self.nested, ctes.names)
+            visitor(tree)
+            _templates[key] = RawStream()(tree) if visitor.num_sampled > 0 else query
+        return _templates[key]
+
+    def sample(self, query: str) -> str:
+        query_digest = hashlib.blake2b(query.encode(), digest_size=16).digest()
+        key = (
+            query_digest,
+            self.nested,
+            self.policy.key(),
+            self.sample_method,
+            self.sample_seed,
+        )
+        if key not in _rewrites:
+            _rewrites[key] = self.template(query_digest, query).replace(
+                PLACEHOLDER,
+                f"TABLESAMPLE {self.sample_method} {self.sample_seed}",
+            )
+        return _rewrites[key]
@@ -1,51 +1,68 @@
 import os
+import sys
 from pathlib import Path
 
-from sqlalchemy import Connection, Engine, create_engine
-from util import (conn_execute, connstr, sql_file_execute,
-                  vacuum_full_analyze_all)
+from datagen import TpchGenerator
+from loader import load_complete, resume_load, vacuum_loaded
+from sqlalchemy import Engine, create_engine
+from util import connstr
 
+TABLES = [
+    "region",
+    "nation",
+    "part",
+    "supplier",
+    "partsupp",
+    "customer",
+    "orders",
+    "lineitem",
+]
 
-def loaded(conn: Connection):
-    res = conn_execute(
-        conn, "SELECT * FROM pg_indexes WHERE indexname = 'l_sk_pk'"
-    ).fetchall()
-    return len(res) > 0
 
-
-def load(conn: Connection):
+def schema_paths() -> tuple[Path, Path]:
     schema_root = Path(os.getenv("TPCH_SCHEMA_ROOT"))
+    return schema_root / "tpch_schema.sql", schema_root / "tpch_constraints.sql"
+
+
+def load(bulk=False, generate=False) -> list[str]:
     data_root = Path(os.getenv("TPCH_DATA_ROOT"))
     tpch_sf = int(os.getenv("TPCH_SF"))
 
-    tables = [
-        "region",
-        "nation",
-        "part",
-        "supplier",
-        "partsupp",
-        "customer",
-        "orders",
-        "lineitem",
-    ]
-
-    sql_file_execute(conn, schema_root / "tpch_schema.sql")
-    for table in tables:
-        conn_execute(conn, f"TRUNCATE {table} CASCADE")
-    for table in tables:
-        table_path = data_root / f"sf_{tpch_sf}" / f"{table}.tbl"
-        conn_execute(conn, f"COPY {table} FROM '{str(table_path)}' CSV DELIMITER '|'")
-    sql_file_execute(conn, schema_root / "tpch_constraints.sql")
+    generator = None
+    if generate:
+        # Stream the generator's output straight into COPY, no data files.
+        num_chunks = int(os.getenv("LOAD_CHUNKS", os.getenv("LOAD_WORKERS", "4")))
+        repo_root = Path(os.getenv("TPCH_REPO_ROOT"))
+        generator = TpchGenerator(repo_root, tpch_sf, num_chunks)
+        table_paths = [(table, generator.binary) for table in TABLES]
+    else:
+        table_paths = [
+            (table, data_root / f"sf_{tpch_sf}" / f"{table}.tbl") for table in TABLES
+        ]
+    return resume_load(
+        TABLES,
+        table_paths,
+        *schema_paths(),
+        legacy_index="l_sk_pk",
+        bulk=bulk,
+        generator=generator,
+    )
 
 
 def main():
+    if sys.argv[1:] == ["complete"]:
+        # Exits 0 if the database is fully loaded, so the data need not exist.
+        sys.exit(0 if load_complete(TABLES, *schema_paths()) else 1)
     engine: Engine = create_engine(
         connstr(), execution_options={"isolation_level": "AUTOCOMMIT"}
     )
     with engine.connect() as conn:
-        if not loaded(conn):
-            load(conn)
-            vacuum_full_analyze_all(engine, conn)
+        bulk = int(os.getenv("LOAD_BULK", "0")) == 1
+        generate = int(os.getenv("LOAD_GENERATE", "0")) == 1
+        tables = load(bulk=bulk, generate=generate)
+        # SET LOGGED already rewrote every bulk-loaded table compactly.
+        command = "VACUUM ANALYZE" if bulk else "VACUUM FULL ANALYZE"
+        vacuum_loaded(engine, conn, tables, command)
 
 
 if __name__ == "__main__":
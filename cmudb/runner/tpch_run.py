@@ -1,16 +1,22 @@
 import os
+import sys
 import time
 import traceback
+from contextlib import nullcontext
 from pathlib import Path
 from typing import Optional
 
 import psycopg.errors
-import sqlalchemy.exc
+from corpus import corpus
+from executor import explain_text, make_pool, make_units, select_configs
+from manifest import Manifest
+from predictor import RuntimePredictor, history_key
+from scheduler import Schedule
+from sink import make_sink
 from sqlalchemy import Connection, Engine, NullPool, create_engine
 from tpch_rewriter import *
-from tqdm import tqdm, trange
-from util import (conn_execute, connstr, prewarm_all, sql_file_queries,
-                  vacuum_analyze_all)
+from tqdm import tqdm
+from util import conn_execute, connstr
 
 
 class Config:
@@ -21,12 +27,16 @@ class Config:
         rewriter: Optional[Rewriter] = None,
         before_sql: Optional[list[str]] = None,
         after_sql: Optional[list[str]] = None,
+        teardown_sql: Optional[list[str]] = None,
     ):
         self.expt_name = expt_name
         self.timeout_s = timeout_s
         self.rewriter = rewriter if rewriter is not None else EARewriter()
         self.before_sql = before_sql if before_sql is not None else []
+        # after_sql runs once when every query is done, then teardown_sql runs on
+        # every backend.
         self.after_sql = after_sql if after_sql is not None else []
+        self.teardown_sql = teardown_sql if teardown_sql is not None else []
 
 
 def tpch(engine: Engine, conn: Connection, config: Config, verbose=False):
@@ -35,100 +45,107 @@ def tpch(engine: Engine, conn: Connection, config: Config, verbose=False):
     query_start = int(os.getenv("TPCH_QUERY_START"))
     query_stop = int(os.getenv("TPCH_QUERY_STOP"))
     tpch_sf = int(os.getenv("TPCH_SF"))
+    pin_seed = int(os.getenv("RUNNER_PIN_SEED", "0")) == 1
 
-    readied = False
-    executed_once = False
-    timeout_queries = []
+    pool = make_pool(engine, conn, config.before_sql, config.timeout_s, verbose)
+    manifest = Manifest(
+        artifact_root / "experiment" / config.expt_name / "tpch" / f"sf_{tpch_sf}"
+    )
+    sink = make_sink(manifest.root)
+    predictor = RuntimePredictor(
+        artifact_root, "tpch", tpch_sf, config.expt_name, config.timeout_s
+    )
 
-    for seed in trange(
-        query_start, query_stop + 1, desc=f"{config.expt_name} TPCH seed.", leave=None
-    ):
-        outdir = (
-            artifact_root
-            / "experiment"
-            / config.expt_name
-            / "tpch"
-            / f"sf_{tpch_sf}"
-            / str(seed)
-        )
+    def finished(key: str, state: str, plan: Optional[str] = None):
+        if sink is not None:
+            sink.append(key, state, plan)
+        manifest.record(key, state)
+
+    def run_unit(unit):
+        seed, query_paths = unit
+        outdir = manifest.root / str(seed)
         outdir.mkdir(parents=True, exist_ok=True)
 
-        for query_path in tqdm(
-            [(query_root / str(seed) / f"{i}.sql") for i in range(1, 22 + 1)],
-            desc=f"{config.expt_name} TPCH query.",
-            leave=None,
-        ):
+        for query_path in query_paths:
             query_num = int(query_path.stem)
-            for query_subnum, query in enumerate(
-                sql_file_queries(query_path.absolute()), 1
-            ):
-                outpath_ok = outdir / f"{query_path.stem}-{query_subnum}.ok"
-                outpath_res = outdir / f"{query_path.stem}-{query_subnum}.res"
-                outpath_timeout = outdir / f"{query_path.stem}-{query_subnum}.timeout"
+            with pool.exclusive() if query_num == 15 else nullcontext():
+                run_query(outdir, query_path, query_num)
 
-                if outpath_timeout.exists():
-                    timeout_queries.append((query_num, query_subnum))
+    def run_query(outdir: Path, query_path: Path, query_num: int):
+        for query_subnum, query in enumerate(corpus().queries(query_path), 1):
+            outpath_res = outdir / f"{query_path.stem}-{query_subnum}.res"
+            outpath_timeout = outdir / f"{query_path.stem}-{query_subnum}.timeout"
+            key = manifest.key(outpath_res)
 
-                if outpath_ok.exists():
-                    continue
+            if key in manifest:
+                continue
 
-                if (query_num, query_subnum) in timeout_queries:
-                    outpath_timeout.touch(exist_ok=True)
-                    outpath_ok.touch(exist_ok=True)
-                    continue
+            history = history_key("tpch", key)
+            prediction = predictor.predict(history)
+            if prediction.skip:
+                outpath_timeout.touch(exist_ok=True)
+                finished(key, "timeout")
+                predictor.skipped()
+                continue
 
+            query, is_ea = config.rewriter.rewrite(query_num, query_subnum, query)
+            # A query cut by an adaptive timeout is retried with the config's.
+            timeouts_s = [prediction.timeout_s]
+            if prediction.timeout_s < config.timeout_s:
+                timeouts_s.append(config.timeout_s)
+            for timeout_s in timeouts_s:
+                start = time.time()
                 try:
-                    if not readied:
-                        conn_execute(
-                            conn, f"SET statement_timeout = '0s'", verbose=verbose
-                        )
-                        prewarm_all(engine, conn, verbose=verbose)
-                        vacuum_analyze_all(engine, conn, verbose=verbose)
-                        for sql in config.before_sql:
-                            conn_execute(conn, sql, verbose=verbose)
-                        conn_execute(
-                            conn,
-                            f"SET statement_timeout = '{config.timeout_s}s'",
-                            verbose=verbose,
-                        )
-                        readied = True
-                        executed_once = True
-
-                    with open(outpath_res, "w") as output_file:
-                        if (query_num, query_subnum) == (15, 1):
-                            conn_execute(
-                                conn, "DROP VIEW IF EXISTS revenue0", verbose=False
-                            )
-
-                        query, is_ea = config.rewriter.rewrite(
-                            query_num, query_subnum, query
-                        )
-                        result = conn_execute(conn, query, verbose=False)
-                        if is_ea:
-                            ea_result = str(result.fetchone()[0][0])
-                            print(ea_result, file=output_file)
-                        outpath_ok.touch(exist_ok=True)
+                    if (query_num, query_subnum) == (15, 1):
+                        pool.execute("DROP VIEW IF EXISTS revenue0")
 
-                except sqlalchemy.exc.OperationalError as e:
-                    if isinstance(e.orig, psycopg.errors.QueryCanceled):
-                        timeout_queries.append((query_num, query_subnum))
-                        outpath_timeout.touch(exist_ok=True)
-                        outpath_ok.touch(exist_ok=True)
-                    else:
-                        raise e
-
-    if executed_once:
-        for sql in config.after_sql:
-            conn_execute(conn, sql, verbose=verbose)
+                    result = pool.execute(query, fetch=is_ea, timeout_s=timeout_s)
+                    predictor.finished(history, "ok", time.time() - start, timeout_s)
+                    ea_result = explain_text(result) if is_ea else None
+                    pool.write(
+                        outpath_res,
+                        ea_result,
+                        done=lambda key=key, plan=ea_result: finished(key, "ok", plan),
+                    )
+                    break
 
+                except psycopg.errors.QueryCanceled:
+                    predictor.finished(
+                        history, "timeout", time.time() - start, timeout_s
+                    )
+                    if timeout_s < config.timeout_s:
+                        continue
+                    pool.write(
+                        outpath_res,
+                        None,
+                        outpath_timeout,
+                        done=lambda key=key: finished(key, "timeout"),
+                    )
 
-def main():
-    engine: Engine = create_engine(
-        connstr(),
-        poolclass=NullPool,
-        execution_options={"isolation_level": "AUTOCOMMIT"},
+    units = make_units(
+        range(query_start, query_stop + 1),
+        lambda seed: [(query_root / str(seed) / f"{i}.sql") for i in range(1, 22 + 1)],
+        pin_seed,
     )
+    schedule = Schedule(engine, conn, units, verbose)
+    try:
+        pool.run(
+            schedule.wrap(run_unit),
+            schedule.units,
+            desc=f"{config.expt_name} TPCH query.",
+        )
+        pool.finish(config.after_sql, config.teardown_sql)
+    finally:
+        pool.close()
+        if sink is not None:
+            sink.close()
+        manifest.close()
+        corpus().save()
+        predictor.report(manifest.root)
+        predictor.close()
 
+
+def make_configs() -> list[Config]:
     def make_bytejack_config(
         enable=False,
         intercept_explain_analyze=False,
@@ -165,10 +182,8 @@ def main():
                 f"SET bytejack.seq_sample_pct={seq_sample_pct}",
                 f"SET bytejack.seq_sample_seed={seq_sample_seed}",
             ],
-            after_sql=[
-                f"SELECT bytejack_save('{name}')",
-                "SELECT bytejack_disconnect()",
-            ],
+            after_sql=[f"SELECT bytejack_save('{name}')"],
+            teardown_sql=["SELECT bytejack_disconnect()"],
         )
 
     configs = [
@@ -231,6 +246,18 @@ def main():
                     ]
                     configs.append(config)
 
+    return configs
+
+
+def main():
+    engine: Engine = create_engine(
+        connstr(),
+        poolclass=NullPool,
+        execution_options={"isolation_level": "AUTOCOMMIT"},
+    )
+
+    configs = select_configs(make_configs())
+    failed = []
     pbar = tqdm(range(len(configs)), desc="Configs.", leave=None)
     for config in configs:
         time.time()
@@ -247,9 +274,14 @@ def main():
         except Exception:
             traceback.print_exc()
             print(f"ERROR FOR CONFIG: {config.expt_name}")
-            pass
+            failed.append(config.expt_name)
         pbar.update()
     pbar.close()
+    # The remaining configs still run, but callers (e.g., the orchestrator) see
+    # that one failed.
+    if len(failed) > 0:
+        print(f"FAILED CONFIGS: {failed}")
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -1,4 +1,6 @@
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import pglast
@@ -14,6 +16,11 @@ def connstr() -> str:
     return f"postgresql+psycopg://{pg_user}:{pg_pass}@{pg_host}:{pg_port}/{pg_db}"
 
 
+def conninfo() -> str:
+    # libpq form of connstr(), for using psycopg directly.
+    return connstr().replace("postgresql+psycopg://", "postgresql://", 1)
+
+
 def sql_file_queries(filepath: Path) -> [str]:
     with open(filepath) as f:
         lines = []
@@ -54,11 +61,149 @@ def prewarm_all(engine: Engine, connection: Connection, verbose=True):
 
 def vacuum_analyze_all(engine: Engine, connection: Connection, verbose=True):
     inspector: Inspector = inspect(engine)
-    for table in inspector.get_table_names():
-        conn_execute(connection, f"VACUUM ANALYZE {table}", verbose=verbose)
+    vacuum_tables(
+        engine, connection, inspector.get_table_names(), "VACUUM ANALYZE", verbose
+    )
 
 
 def vacuum_full_analyze_all(engine: Engine, connection: Connection, verbose=True):
     inspector: Inspector = inspect(engine)
-    for table in inspector.get_table_names():
-        conn_execute(connection, f"VACUUM FULL ANALYZE {table}", verbose=verbose)
+    vacuum_tables(
+        engine, connection, inspector.get_table_names(), "VACUUM FULL ANALYZE", verbose
+    )
+
+
+def vacuum_tables(
+    engine: Engine,
+    connection: Connection,
+    tables: list[str],
+    command: str,
+    verbose=True,
+) -> list[dict]:
+    # Largest tables go first over a bounded pool of connections, so that small
+    # tables fill in around them instead of queueing behind them. If a memory
+    # budget is given, it is split evenly as each connection's maintenance_work_mem.
+    num_workers = max(1, int(os.getenv("VACUUM_WORKERS", "4")))
+    memory_budget_mb = os.getenv("VACUUM_MEMORY_MB", "")
+    sizes = {
+        relname: num_blocks
+        for relname, relkind, num_blocks in relations(connection, verbose=False)
+        if relkind == "r"
+    }
+    tables = sorted(tables, key=lambda table: sizes.get(table, 0), reverse=True)
+
+    def vacuum(table: str) -> dict:
+        with engine.connect() as conn:
+            conn_execute(conn, "SET statement_timeout = '0s'", verbose=verbose)
+            if len(memory_budget_mb) > 0:
+                work_mem_mb = max(1, int(memory_budget_mb) // num_workers)
+                conn_execute(
+                    conn,
+                    f"SET maintenance_work_mem = '{work_mem_mb}MB'",
+                    verbose=verbose,
+                )
+            start = time.time()
+            conn_execute(conn, f"{command} {table}", verbose=verbose)
+            return {"Table": table, "Seconds": time.time() - start}
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        stats = list(executor.map(vacuum, tables))
+    if verbose:
+        for stat in stats:
+            print(f"{stat['Table']:<24} {stat['Seconds']:>8.1f} s {command}")
+    return stats
+
+
+def relations(connection: Connection, verbose=True) -> list[tuple[str, str, int]]:
+    # (relname, relkind, main fork blocks) for every table and index, largest first.
+    return conn_execute(
+        connection,
+        "SELECT c.relname, c.relkind, "
+        "pg_relation_size(c.oid) / current_setting('block_size')::int "
+        "FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE n.nspname = current_schema() AND c.relkind IN ('r', 'i') "
+        "ORDER BY 3 DESC, 1",
+        verbose=verbose,
+    ).fetchall()
+
+
+def resident_blocks(connection: Connection, verbose=True) -> dict[str, int]:
+    conn_execute(
+        connection, "CREATE EXTENSION IF NOT EXISTS pg_buffercache", verbose=verbose
+    )
+    rows = conn_execute(
+        connection,
+        "SELECT c.relname, count(*) FROM pg_buffercache b "
+        "JOIN pg_class c ON b.relfilenode = pg_relation_filenode(c.oid) "
+        "JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE b.reldatabase = (SELECT oid FROM pg_database WHERE datname = current_database()) "
+        "AND b.relforknumber = 0 AND n.nspname = current_schema() "
+        "GROUP BY c.relname",
+        verbose=verbose,
+    ).fetchall()
+    return {relname: num_blocks for relname, num_blocks in rows}
+
+
+def prewarm_nonresident(
+    engine: Engine, connection: Connection, num_workers: int = 4, verbose=True
+):
+    # Like prewarm_all, but skips relations already fully in shared buffers and
+    # prewarms the rest over several connections. If the relations do not all fit
+    # in shared buffers, which ones stay resident depends on the prewarm order,
+    # so prewarm_all's sequential order is kept instead.
+    conn_execute(
+        connection, "CREATE EXTENSION IF NOT EXISTS pg_prewarm", verbose=verbose
+    )
+    all_relations = relations(connection, verbose=verbose)
+    # shared_buffers is reported in blocks.
+    shared_blocks = conn_execute(
+        connection,
+        "SELECT setting::bigint FROM pg_settings WHERE name = 'shared_buffers'",
+        verbose=verbose,
+    ).fetchone()[0]
+    if sum(num_blocks for _, _, num_blocks in all_relations) > shared_blocks:
+        prewarm_all(engine, connection, verbose=verbose)
+        return
+    resident = resident_blocks(connection, verbose=verbose)
+    pending = [
+        relname
+        for relname, _, num_blocks in all_relations
+        if resident.get(relname, 0) < num_blocks
+    ]
+    if len(pending) == 0:
+        return
+
+    def prewarm(relnames: list[str]):
+        with engine.connect() as conn:
+            conn_execute(conn, "SET statement_timeout = '0s'", verbose=verbose)
+            for relname in relnames:
+                conn_execute(conn, f"SELECT pg_prewarm('{relname}')", verbose=verbose)
+
+    # Relations are sorted largest first, so dealing them out round-robin keeps
+    # the per-connection totals roughly even.
+    num_workers = max(1, min(num_workers, len(pending)))
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = [
+            executor.submit(prewarm, pending[i::num_workers])
+            for i in range(num_workers)
+        ]
+        for future in futures:
+            future.result()
+
+
+def vacuum_analyze_changed(engine: Engine, connection: Connection, verbose=True):
+    # Like vacuum_analyze_all, but skips tables that have not changed since they
+    # were last vacuumed and analyzed.
+    rows = conn_execute(
+        connection,
+        "SELECT relname FROM pg_stat_user_tables "
+        "WHERE schemaname = current_schema() "
+        "AND n_mod_since_analyze = 0 AND n_ins_since_vacuum = 0 AND n_dead_tup = 0 "
+        "AND coalesce(last_vacuum, last_autovacuum) IS NOT NULL "
+        "AND coalesce(last_analyze, last_autoanalyze) IS NOT NULL",
+        verbose=verbose,
+    ).fetchall()
+    unchanged = {relname for relname, in rows}
+    inspector: Inspector = inspect(engine)
+    tables = [table for table in inspector.get_table_names() if table not in unchanged]
+    vacuum_tables(engine, connection, tables, "VACUUM ANALYZE", verbose)